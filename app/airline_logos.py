@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import base64
+import requests
+import pandas as pd
+
+# Local disk cache of airline logos, keyed by IATA carrier code, so that the
+# results page embeds logos instead of hot-linking a third-party host
+
+LOGO_SOURCE_URL = "https://airlabs.co/img/airline/m/{airline_code}.png"
+LOGO_CACHE_DIR = os.path.join('data', 'logos')
+
+# Failed downloads are remembered and only retried after this many seconds
+MISSING_RETRY_SECONDS = 7 * 24 * 3600
+
+# Neutral placeholder shown when no logo is cached for a carrier
+FALLBACK_LOGO_SVG = """<svg xmlns="http://www.w3.org/2000/svg" width="100" height="50" viewBox="0 0 100 50">
+<rect width="100" height="50" rx="8" fill="#E6E6EE"/>
+<path d="M50 12 L54 24 L72 28 L72 31 L54 29 L53 38 L58 41 L58 43 L50 41 L42 43 L42 41 L47 38 L46 29 L28 31 L28 28 L46 24 Z" fill="#13133D"/>
+</svg>"""
+FALLBACK_LOGO_URI = "data:image/svg+xml;base64," + base64.b64encode(FALLBACK_LOGO_SVG.encode()).decode()
+
+
+def get_logo_path(airline_code, cache_dir=LOGO_CACHE_DIR):
+    return os.path.join(cache_dir, f"{airline_code}.png")
+
+
+def _get_missing_marker_path(airline_code, cache_dir=LOGO_CACHE_DIR):
+    return os.path.join(cache_dir, f"{airline_code}.missing")
+
+
+# Function to download a single logo into the cache, returns True if the logo is cached afterwards
+def fetch_logo(airline_code, cache_dir=LOGO_CACHE_DIR, force=False, timeout=5):
+    logo_path = get_logo_path(airline_code, cache_dir)
+    missing_marker = _get_missing_marker_path(airline_code, cache_dir)
+
+    if not force:
+        if os.path.exists(logo_path):
+            return True
+        # Skip carriers whose logo recently failed to download
+        if os.path.exists(missing_marker) and time.time() - os.path.getmtime(missing_marker) < MISSING_RETRY_SECONDS:
+            return False
+
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        response = requests.get(LOGO_SOURCE_URL.format(airline_code=airline_code), timeout=timeout)
+        is_image = response.headers.get('Content-Type', '').startswith('image/')
+        if response.status_code == 200 and is_image and response.content:
+            # Write to a temporary file first so readers never see a partial logo
+            tmp_path = f"{logo_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, logo_path)
+            if os.path.exists(missing_marker):
+                os.remove(missing_marker)
+            return True
+        print(f"No logo available for {airline_code}: {response.status_code}", file=sys.stderr)
+    except requests.RequestException as e:
+        print(f"Error fetching logo for {airline_code}: {e}", file=sys.stderr)
+
+    with open(missing_marker, 'w'):
+        pass
+    return False
+
+
+# Function to make sure the logos of the given carriers are cached
+def cache_logos(airline_codes, cache_dir=LOGO_CACHE_DIR, force=False):
+    cached = 0
+    for airline_code in sorted(set(airline_codes)):
+        if fetch_logo(airline_code, cache_dir, force=force):
+            cached += 1
+    return cached
+
+
+# Function to pre-fill the cache with the logos of all carriers listed in the airlines CSV
+def prefill_logo_cache(airlines_csv='data/airlines.csv', cache_dir=LOGO_CACHE_DIR, force=False):
+    airlines_df = pd.read_csv(airlines_csv)
+    airline_codes = airlines_df['IATA'].dropna().astype(str).str.strip()
+    airline_codes = [code for code in airline_codes if code]
+    cached = cache_logos(airline_codes, cache_dir, force=force)
+    print(f"{cached} of {len(set(airline_codes))} airline logos cached in {cache_dir}", file=sys.stderr)
+    return cached
+
+
+# Function to get a logo as an embeddable data URI, never makes a network request
+def get_logo_data_uri(airline_code, cache_dir=LOGO_CACHE_DIR):
+    logo_path = get_logo_path(airline_code, cache_dir)
+    try:
+        with open(logo_path, 'rb') as f:
+            logo_bytes = f.read()
+    except OSError:
+        return FALLBACK_LOGO_URI
+    return "data:image/png;base64," + base64.b64encode(logo_bytes).decode()
+
+
+if __name__ == "__main__":
+    # Usage: python app/airline_logos.py [--force]
+    prefill_logo_cache(force='--force' in sys.argv[1:])
@@ -29,6 +29,7 @@ def check_password():
             st.secrets.passwords[st.session_state["username"]],
         ):
             st.session_state["password_correct"] = True
+            st.session_state["user"] = st.session_state["username"]  # Recorded with the user's searches
             del st.session_state["password"]  # Don't store the username or password.
             del st.session_state["username"]
         else:
@@ -1,8 +1,9 @@
 import os
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
 import json
+import hashlib
 import sys
 from datetime import datetime
 
@@ -48,6 +49,147 @@ def create_tables():
                         FOREIGN KEY (search_inputs_id) REFERENCES search_inputs_{environment}(id)
                     )
                 """)
+        # Indexes of the search history: newest first overall, per user and per origin or destination,
+        # with (created_at, id) last so keyset pagination stays an index range scan as history grows
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS search_inputs_{environment}_created_idx
+            ON search_inputs_{environment} (created_at DESC, id DESC)
+        """)
+        for field in ('user', 'origin', 'destination'):
+            cur.execute(f"""
+                CREATE INDEX IF NOT EXISTS search_inputs_{environment}_{field}_idx
+                ON search_inputs_{environment} ((data->>'{field}'), created_at DESC, id DESC)
+            """)
+        # Per-date progress of sweeps, so an interrupted sweep can be resumed
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS sweep_checkpoints_{environment} (
+                id SERIAL PRIMARY KEY,
+                search_key TEXT NOT NULL,
+                departure_date DATE NOT NULL,
+                search_inputs_id INTEGER,
+                data JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (search_inputs_id) REFERENCES search_inputs_{environment}(id)
+            )
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS sweep_checkpoints_{environment}_key_idx
+            ON sweep_checkpoints_{environment} (search_key, departure_date, created_at DESC)
+        """)
+        # Queue of searches run by the background sweep workers
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS sweep_jobs_{environment} (
+                id SERIAL PRIMARY KEY,
+                search_inputs_id INTEGER,
+                data JSONB,
+                status TEXT NOT NULL DEFAULT 'queued',
+                progress INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                result JSONB,
+                notice TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                heartbeat_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                FOREIGN KEY (search_inputs_id) REFERENCES search_inputs_{environment}(id)
+            )
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS sweep_jobs_{environment}_status_idx
+            ON sweep_jobs_{environment} (status, created_at)
+        """)
+        # Prices observed by the price watcher, per search and departure date
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS price_observations_{environment} (
+                id SERIAL PRIMARY KEY,
+                search_key TEXT NOT NULL,
+                search_inputs_id INTEGER,
+                departure_date DATE NOT NULL,
+                price NUMERIC,
+                currency TEXT,
+                previous_price NUMERIC,
+                is_drop BOOLEAN DEFAULT FALSE,
+                data JSONB,
+                observed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (search_inputs_id) REFERENCES search_inputs_{environment}(id)
+            )
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS price_observations_{environment}_key_idx
+            ON price_observations_{environment} (search_key, departure_date, observed_at DESC)
+        """)
+        # One row per price watcher cycle: its budget and the tasks it chose
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS watcher_runs_{environment} (
+                id SERIAL PRIMARY KEY,
+                budget INTEGER,
+                requests_used INTEGER DEFAULT 0,
+                candidates INTEGER,
+                decisions JSONB,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        # Route graph: direct connections seen in offers or listed by the routes endpoint,
+        # and the origins whose complete list of direct destinations was fetched
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS direct_routes_{environment} (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                source TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (origin, destination, source)
+            )
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS direct_route_origins_{environment} (
+                origin TEXT PRIMARY KEY,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Deduplicated offer storage: each distinct segment and itinerary is stored once under the
+        # hash of its content, each recorded date of a search as a snapshot of price observations
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS offer_segments_{environment} (
+                hash TEXT PRIMARY KEY,
+                data JSONB NOT NULL
+            )
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS offer_itineraries_{environment} (
+                hash TEXT PRIMARY KEY,
+                segment_hashes TEXT[] NOT NULL,
+                data JSONB NOT NULL
+            )
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS offer_snapshots_{environment} (
+                id SERIAL PRIMARY KEY,
+                search_inputs_id INTEGER REFERENCES search_inputs_{environment}(id),
+                offer_count INTEGER NOT NULL,
+                json_bytes INTEGER NOT NULL,
+                raw_payload BYTEA,
+                write_ms DOUBLE PRECISION,
+                source_id INTEGER UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS offer_snapshots_{environment}_search_idx
+            ON offer_snapshots_{environment} (search_inputs_id, created_at)
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS offer_observations_{environment} (
+                snapshot_id INTEGER NOT NULL REFERENCES offer_snapshots_{environment}(id),
+                position INTEGER NOT NULL,
+                price NUMERIC NOT NULL,
+                currency TEXT NOT NULL,
+                itinerary_hashes TEXT[] NOT NULL,
+                PRIMARY KEY (snapshot_id, position)
+            )
+        """)
         conn.commit()
         print("Tables created successfully", file=sys.stderr)
     except Exception as e:
@@ -58,20 +200,52 @@ def create_tables():
         conn.close()
 
 
-def get_past_searches(limit=10):
+# Function to list stored searches, newest first, optionally filtered by user, route and creation date range.
+# Uses keyset pagination: pass the cursor returned with a page as `before` to get the next (older) page.
+# Returns the rows (id, data, created_at) and the cursor of the next page, or None on the last page.
+def get_past_searches(limit=10, user=None, origin=None, destination=None, created_from=None, created_to=None, before=None):
     conn = get_db_connection()
     cur = conn.cursor()
-    table_name = f"searches_{environment}"
-    cur.execute(f"""
-        SELECT id, search_inputs, search_time 
-        FROM {table_name} 
-        ORDER BY search_time DESC 
-        LIMIT %s
-    """, (limit,))
-    searches = cur.fetchall()
-    cur.close()
-    conn.close()
-    return searches
+    table_name = f"search_inputs_{environment}"
+    conditions = []
+    params = []
+    if user:
+        conditions.append("data->>'user' = %s")
+        params.append(user)
+    if origin:
+        conditions.append("data->>'origin' = %s")
+        params.append(origin)
+    if destination:
+        conditions.append("data->>'destination' = %s")
+        params.append(destination)
+    if created_from:
+        conditions.append("created_at >= %s")
+        params.append(created_from)
+    if created_to:
+        conditions.append("created_at < %s")
+        params.append(created_to)
+    if before:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(before)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        # One extra row tells whether there is a next page
+        cur.execute(f"""
+            SELECT id, data, created_at
+            FROM {table_name}
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, params + [limit + 1])
+        searches = cur.fetchall()
+        next_cursor = None
+        if len(searches) > limit:
+            searches = searches[:limit]
+            next_cursor = (searches[-1][2], searches[-1][0])
+        return searches, next_cursor
+    finally:
+        cur.close()
+        conn.close()
 
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -109,3 +283,702 @@ def insert_data(data, table_name, search_inputs_id=None):
     finally:
         cur.close()
         conn.close()
+
+
+# Function to turn the ISO datetime strings of a stored itinerary back into datetime objects
+def decode_itinerary(itinerary):
+    for segment in itinerary['segments']:
+        for endpoint in ('departure', 'arrival'):
+            if isinstance(segment[endpoint]['at'], str):
+                segment[endpoint]['at'] = datetime.fromisoformat(segment[endpoint]['at'])
+    return itinerary
+
+
+# Function to decode the itineraries of a stored row of the results table, including the
+# best value offer of its date when one is kept alongside the cheapest
+def decode_flight_price(flight_price):
+    decode_itinerary(flight_price['outbound_itinerary'])
+    decode_itinerary(flight_price['return_itinerary'])
+    if flight_price.get('best_value'):
+        decode_flight_price(flight_price['best_value'])
+    return flight_price
+
+
+# Function to get the checkpoint key of a search: every input that affects the result of a single
+# date, so re-submitting the search (or one with an overlapping travel period) can reuse its dates
+def get_sweep_key(search_inputs):
+    key_fields = ['origin', 'destination', 'number_of_nights', 'flight_type', 'travel_class',
+                  'departure_time_option', 'return_time_option', 'environment']
+    key_data = {field: search_inputs.get(field) for field in key_fields}
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Function to record the outcome of one sweep date, data is None when the date has no matching offer
+def insert_checkpoint(search_key, departure_date, data, search_inputs_id=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_checkpoints_{environment}"
+    try:
+        json_data = json.dumps(data, cls=DateTimeEncoder) if data is not None else None
+        cur.execute(f"""
+            INSERT INTO {table_name} (search_key, departure_date, search_inputs_id, data)
+            VALUES (%s, %s, %s, %s)
+        """, (search_key, departure_date, search_inputs_id, json_data))
+        conn.commit()
+    except Exception as e:
+        print(f"An error occurred while inserting checkpoint into {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the latest checkpoint per departure date of a search, younger than max_age_minutes
+def get_checkpoints(search_key, max_age_minutes):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_checkpoints_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT DISTINCT ON (departure_date) departure_date, data
+            FROM {table_name}
+            WHERE search_key = %s
+              AND created_at >= CURRENT_TIMESTAMP - make_interval(mins => %s)
+            ORDER BY departure_date, created_at DESC
+        """, (search_key, max_age_minutes))
+        checkpoints = {}
+        for departure_date, data in cur.fetchall():
+            # Pre-pass selections are checkpointed too and carry no itineraries
+            if data is not None and 'outbound_itinerary' in data:
+                decode_flight_price(data)
+            checkpoints[departure_date.strftime('%Y-%m-%d')] = data
+        return checkpoints
+    except Exception as e:
+        print(f"An error occurred while reading checkpoints from {table_name}: {e}", file=sys.stderr)
+        return {}
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to queue a search for the background sweep workers
+def insert_job(search_inputs, search_inputs_id=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_jobs_{environment}"
+    try:
+        cur.execute(f"""
+            INSERT INTO {table_name} (search_inputs_id, data)
+            VALUES (%s, %s)
+            RETURNING id
+        """, (search_inputs_id, json.dumps(search_inputs, cls=DateTimeEncoder)))
+        job_id = cur.fetchone()[0]
+        conn.commit()
+        print(f"Job {job_id} queued in {table_name}", file=sys.stderr)
+        return job_id
+    except Exception as e:
+        print(f"An error occurred while queuing job in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to claim the oldest queued job, or a running job whose worker stopped sending heartbeats.
+# SKIP LOCKED lets any number of workers on any host poll the queue without claiming the same job.
+def claim_job(worker, stale_after_seconds=300):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_jobs_{environment}"
+    try:
+        cur.execute(f"""
+            UPDATE {table_name}
+            SET status = 'running', worker = %s, started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM {table_name}
+                WHERE status = 'queued'
+                   OR (status = 'running' AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, search_inputs_id, data
+        """, (worker, stale_after_seconds))
+        job = cur.fetchone()
+        conn.commit()
+        return job
+    except Exception as e:
+        print(f"An error occurred while claiming a job from {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to record the progress of a running job, which also serves as its heartbeat.
+# Only the worker holding the job may update it: returns False once another worker reclaimed it,
+# None if the update failed.
+def update_job(job_id, worker, progress=None, total=None, result=None, notice=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_jobs_{environment}"
+    try:
+        json_result = json.dumps(result, cls=DateTimeEncoder) if result is not None else None
+        cur.execute(f"""
+            UPDATE {table_name}
+            SET progress = COALESCE(%s, progress),
+                total = COALESCE(%s, total),
+                result = COALESCE(%s, result),
+                notice = COALESCE(%s, notice),
+                heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND worker = %s AND status = 'running'
+        """, (progress, total, json_result, notice, job_id, worker))
+        updated = cur.rowcount > 0
+        conn.commit()
+        return updated
+    except Exception as e:
+        print(f"An error occurred while updating job {job_id} in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to mark a job as done with its results, or as failed with an error message.
+# Like update_job, returns False when the worker no longer holds the job.
+def finish_job(job_id, worker, result=None, error=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_jobs_{environment}"
+    try:
+        json_result = json.dumps(result, cls=DateTimeEncoder) if result is not None else None
+        cur.execute(f"""
+            UPDATE {table_name}
+            SET status = %s, result = COALESCE(%s, result), error = %s, finished_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND worker = %s AND status = 'running'
+        """, ('failed' if error else 'done', json_result, error, job_id, worker))
+        finished = cur.rowcount > 0
+        conn.commit()
+        return finished
+    except Exception as e:
+        print(f"An error occurred while finishing job {job_id} in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the status, progress and (partial) results of a job
+def get_job(job_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_jobs_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT id, search_inputs_id, status, progress, total, result, notice, error, worker, created_at, started_at, finished_at
+            FROM {table_name}
+            WHERE id = %s
+        """, (job_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        columns = [column[0] for column in cur.description]
+        job = dict(zip(columns, row))
+        for flight_price in job['result'] or []:
+            decode_flight_price(flight_price)
+        return job
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the latest stored search per checkpoint key created in the last lookback_days
+def get_watched_searches(lookback_days):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"search_inputs_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT id, data
+            FROM {table_name}
+            WHERE created_at >= CURRENT_TIMESTAMP - make_interval(days => %s)
+            ORDER BY created_at DESC
+        """, (lookback_days,))
+        searches = {}
+        for search_inputs_id, data in cur.fetchall():
+            searches.setdefault(get_sweep_key(data), (search_inputs_id, data))
+        return list(searches.values())
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the most recent observed prices and their age in hours per (search key, departure date), newest first
+def get_price_history(search_keys, per_date=10):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"price_observations_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT search_key, departure_date, price, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - observed_at) / 3600
+            FROM (
+                SELECT search_key, departure_date, price, observed_at,
+                       ROW_NUMBER() OVER (PARTITION BY search_key, departure_date ORDER BY observed_at DESC) AS rank
+                FROM {table_name}
+                WHERE search_key = ANY(%s)
+            ) ranked
+            WHERE rank <= %s
+            ORDER BY search_key, departure_date, observed_at DESC
+        """, (list(search_keys), per_date))
+        history = {}
+        for search_key, departure_date, price, hours_ago in cur.fetchall():
+            history.setdefault((search_key, departure_date), []).append(
+                (float(price) if price is not None else None, float(hours_ago))
+            )
+        return history
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the (price, hours ago) of the latest checkpoint per (search key, departure date),
+# the price None for dates checkpointed without a matching offer
+def get_checkpoint_prices(search_keys):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"sweep_checkpoints_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT DISTINCT ON (search_key, departure_date) search_key, departure_date, (data->>'price')::NUMERIC,
+                   EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - created_at) / 3600
+            FROM {table_name}
+            WHERE search_key = ANY(%s)
+            ORDER BY search_key, departure_date, created_at DESC
+        """, (list(search_keys),))
+        return {
+            (search_key, departure_date): (float(price) if price is not None else None, float(hours_ago))
+            for search_key, departure_date, price, hours_ago in cur.fetchall()
+        }
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to record a price observation of the price watcher
+def insert_observation(search_key, search_inputs_id, departure_date, flight_price, previous_price, is_drop):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"price_observations_{environment}"
+    try:
+        cur.execute(f"""
+            INSERT INTO {table_name} (search_key, search_inputs_id, departure_date, price, currency, previous_price, is_drop, data)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            search_key, search_inputs_id, departure_date,
+            flight_price['price'] if flight_price else None,
+            flight_price['currency'] if flight_price else None,
+            previous_price, is_drop,
+            json.dumps(flight_price, cls=DateTimeEncoder) if flight_price else None
+        ))
+        conn.commit()
+    except Exception as e:
+        print(f"An error occurred while inserting observation into {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the API requests all price watchers used in the last hour
+def get_watcher_requests_last_hour():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"watcher_runs_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT COALESCE(SUM(requests_used), 0)
+            FROM {table_name}
+            WHERE started_at >= CURRENT_TIMESTAMP - INTERVAL '1 hour'
+        """)
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to record a price watcher cycle, or update it once its requests are done
+def save_watcher_run(budget, candidates, decisions, requests_used=0, run_id=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"watcher_runs_{environment}"
+    try:
+        if run_id is None:
+            cur.execute(f"""
+                INSERT INTO {table_name} (budget, requests_used, candidates, decisions)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            """, (budget, requests_used, candidates, json.dumps(decisions, cls=DateTimeEncoder)))
+            run_id = cur.fetchone()[0]
+        else:
+            cur.execute(f"""
+                UPDATE {table_name}
+                SET requests_used = %s, decisions = %s, finished_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (requests_used, json.dumps(decisions, cls=DateTimeEncoder), run_id))
+        conn.commit()
+        return run_id
+    except Exception as e:
+        print(f"An error occurred while saving watcher run in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return run_id
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the latest price watcher cycles
+def get_watcher_runs(limit=10):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"watcher_runs_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT id, budget, requests_used, candidates, decisions, started_at, finished_at
+            FROM {table_name}
+            ORDER BY started_at DESC
+            LIMIT %s
+        """, (limit,))
+        columns = [column[0] for column in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the latest recorded results table of a search
+def get_flight_prices(search_inputs_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"flight_prices_{environment}"
+    try:
+        cur.execute(f"""
+            SELECT data
+            FROM {table_name}
+            WHERE search_inputs_id = %s
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (search_inputs_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        flight_prices = row[0]
+        for flight_price in flight_prices:
+            decode_flight_price(flight_price)
+        return flight_prices
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to record direct connections (origin, destination) of the route graph from a source
+def upsert_direct_routes(routes, source):
+    if not routes:
+        return
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"direct_routes_{environment}"
+    try:
+        cur.executemany(f"""
+            INSERT INTO {table_name} (origin, destination, source, updated_at)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (origin, destination, source) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+        """, [(origin, destination, source) for origin, destination in routes])
+        conn.commit()
+    except Exception as e:
+        print(f"An error occurred while recording routes in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to fill the route graph with the direct connections of all recorded offers,
+# from both the JSONB and the deduplicated offer storage
+def rebuild_observed_routes():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"direct_routes_{environment}"
+    observed_routes = [
+        f"""
+            SELECT itinerary->'segments'->0->'departure'->>'iataCode',
+                   itinerary->'segments'->0->'arrival'->>'iataCode',
+                   parsed_offers.created_at
+            FROM parsed_offers_{environment} parsed_offers,
+                 jsonb_array_elements(parsed_offers.data) offer,
+                 jsonb_array_elements(offer->'itineraries') itinerary
+            WHERE jsonb_array_length(itinerary->'segments') = 1
+        """,
+        f"""
+            SELECT segments.data->'departure'->>'iataCode',
+                   segments.data->'arrival'->>'iataCode',
+                   snapshots.created_at
+            FROM offer_snapshots_{environment} snapshots
+            JOIN offer_observations_{environment} observations ON observations.snapshot_id = snapshots.id
+            CROSS JOIN LATERAL unnest(observations.itinerary_hashes) AS itinerary_hash
+            JOIN offer_itineraries_{environment} itineraries ON itineraries.hash = itinerary_hash
+            JOIN offer_segments_{environment} segments ON segments.hash = itineraries.segment_hashes[1]
+            WHERE cardinality(itineraries.segment_hashes) = 1
+        """
+    ]
+    try:
+        routes = 0
+        for observed_route_query in observed_routes:
+            cur.execute(f"""
+                INSERT INTO {table_name} (origin, destination, source, updated_at)
+                SELECT origin, destination, 'observed', MAX(observed_at)
+                FROM ({observed_route_query}) AS observed (origin, destination, observed_at)
+                GROUP BY origin, destination
+                ON CONFLICT (origin, destination, source)
+                DO UPDATE SET updated_at = GREATEST({table_name}.updated_at, EXCLUDED.updated_at)
+            """)
+            routes += cur.rowcount
+        conn.commit()
+        print(f"{routes} observed direct routes recorded in {table_name}", file=sys.stderr)
+        return routes
+    except Exception as e:
+        print(f"An error occurred while rebuilding routes in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to record that the complete list of direct destinations of an origin was fetched
+def mark_route_origin_fetched(origin):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"direct_route_origins_{environment}"
+    try:
+        cur.execute(f"""
+            INSERT INTO {table_name} (origin, fetched_at)
+            VALUES (%s, CURRENT_TIMESTAMP)
+            ON CONFLICT (origin) DO UPDATE SET fetched_at = CURRENT_TIMESTAMP
+        """, (origin,))
+        conn.commit()
+    except Exception as e:
+        print(f"An error occurred while recording route origin in {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the direct destinations of an origin updated within max_age_hours, and whether
+# a complete destination list of the origin was fetched within that time
+def get_direct_routes(origin, max_age_hours):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT DISTINCT destination
+            FROM direct_routes_{environment}
+            WHERE origin = %s AND updated_at >= CURRENT_TIMESTAMP - make_interval(hours => %s)
+        """, (origin, max_age_hours))
+        destinations = {row[0] for row in cur.fetchall()}
+        cur.execute(f"""
+            SELECT 1
+            FROM direct_route_origins_{environment}
+            WHERE origin = %s AND fetched_at >= CURRENT_TIMESTAMP - make_interval(hours => %s)
+        """, (origin, max_age_hours))
+        complete = cur.fetchone() is not None
+        return destinations, complete
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to record a snapshot of offers in the deduplicated offer storage, in one transaction.
+# Segments and itineraries already stored are skipped; returns the snapshot id and the number of
+# new segments and itineraries. The write duration is recorded with the snapshot: prepare_ms spent
+# preparing the rows plus the time of the transaction. Snapshots migrated from a parsed_offers row
+# carry its id as source_id, and a row already migrated is not recorded again (snapshot id None).
+def insert_offer_snapshot(search_inputs_id, segments, itineraries, observations, json_bytes, raw_payload=None,
+                          created_at=None, source_id=None, prepare_ms=0.0):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    table_name = f"offer_snapshots_{environment}"
+    try:
+        cur.execute(f"""
+            INSERT INTO {table_name} (search_inputs_id, offer_count, json_bytes, raw_payload, created_at, source_id)
+            VALUES (%s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s)
+            ON CONFLICT (source_id) DO NOTHING
+            RETURNING id
+        """, (search_inputs_id, len(observations), json_bytes,
+              psycopg2.Binary(raw_payload) if raw_payload is not None else None, created_at, source_id))
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None, 0, 0
+        snapshot_id = row[0]
+        # Rows in hash order: concurrent writers sharing segments or itineraries then lock
+        # their rows in the same order and cannot deadlock on each other
+        new_segments = execute_values(cur, f"""
+            INSERT INTO offer_segments_{environment} (hash, data) VALUES %s
+            ON CONFLICT (hash) DO NOTHING
+            RETURNING hash
+        """, [(segment_hash, json.dumps(segment, cls=DateTimeEncoder)) for segment_hash, segment in sorted(segments.items())], fetch=True)
+        new_itineraries = execute_values(cur, f"""
+            INSERT INTO offer_itineraries_{environment} (hash, segment_hashes, data) VALUES %s
+            ON CONFLICT (hash) DO NOTHING
+            RETURNING hash
+        """, [(itinerary_hash, segment_hashes, json.dumps(summary, cls=DateTimeEncoder))
+              for itinerary_hash, (segment_hashes, summary) in sorted(itineraries.items())], fetch=True)
+        if observations:
+            execute_values(cur, f"""
+                INSERT INTO offer_observations_{environment} (snapshot_id, position, price, currency, itinerary_hashes) VALUES %s
+            """, [(snapshot_id, position, price, currency, itinerary_hashes)
+                  for position, (price, currency, itinerary_hashes) in enumerate(observations)])
+        # now() is the start of the transaction
+        cur.execute(f"""
+            UPDATE {table_name}
+            SET write_ms = %s + EXTRACT(EPOCH FROM clock_timestamp() - now()) * 1000
+            WHERE id = %s
+        """, (prepare_ms, snapshot_id))
+        conn.commit()
+        return snapshot_id, len(new_segments), len(new_itineraries)
+    except Exception as e:
+        print(f"An error occurred while inserting offer snapshot into {table_name}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None, 0, 0
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the offer snapshots of a search from the deduplicated offer storage, oldest first:
+# the snapshots as (id, created_at, observations) and the itineraries and segments they point to
+def get_offer_snapshots(search_inputs_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT snapshots.id, snapshots.created_at, observations.price, observations.currency, observations.itinerary_hashes
+            FROM offer_snapshots_{environment} snapshots
+            LEFT JOIN offer_observations_{environment} observations ON observations.snapshot_id = snapshots.id
+            WHERE snapshots.search_inputs_id = %s
+            ORDER BY snapshots.created_at, snapshots.id, observations.position
+        """, (search_inputs_id,))
+        snapshots = {}
+        for snapshot_id, created_at, price, currency, itinerary_hashes in cur.fetchall():
+            _, _, observations = snapshots.setdefault(snapshot_id, (snapshot_id, created_at, []))
+            if itinerary_hashes is not None:
+                observations.append((float(price), currency, itinerary_hashes))
+
+        itinerary_hashes = {h for _, _, observations in snapshots.values() for _, _, hashes in observations for h in hashes}
+        cur.execute(f"""
+            SELECT hash, segment_hashes, data FROM offer_itineraries_{environment} WHERE hash = ANY(%s)
+        """, (list(itinerary_hashes),))
+        itineraries = {itinerary_hash: (segment_hashes, data) for itinerary_hash, segment_hashes, data in cur.fetchall()}
+
+        segment_hashes = {h for hashes, _ in itineraries.values() for h in hashes}
+        cur.execute(f"""
+            SELECT hash, data FROM offer_segments_{environment} WHERE hash = ANY(%s)
+        """, (list(segment_hashes),))
+        segments = dict(cur.fetchall())
+        return list(snapshots.values()), itineraries, segments
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the compressed raw API payload kept with an offer snapshot, or None
+def get_offer_snapshot_payload(snapshot_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT raw_payload FROM offer_snapshots_{environment} WHERE id = %s
+        """, (snapshot_id,))
+        row = cur.fetchone()
+        return bytes(row[0]) if row and row[0] is not None else None
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the parsed offers recorded as JSONB for a search and not migrated to the deduplicated
+# storage, oldest first, as (id, created_at, data)
+def get_parsed_offer_rows(search_inputs_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT id, created_at, data
+            FROM parsed_offers_{environment} parsed_offers
+            WHERE search_inputs_id = %s
+              AND NOT EXISTS (SELECT 1 FROM offer_snapshots_{environment} WHERE source_id = parsed_offers.id)
+            ORDER BY created_at, id
+        """, (search_inputs_id,))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get a batch of parsed offers recorded as JSONB with ids above after_id and not migrated to the
+# deduplicated storage yet, as (id, search_inputs_id, created_at, data)
+def get_parsed_offer_batch(after_id, limit):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT id, search_inputs_id, created_at, data
+            FROM parsed_offers_{environment} parsed_offers
+            WHERE id > %s
+              AND NOT EXISTS (SELECT 1 FROM offer_snapshots_{environment} WHERE source_id = parsed_offers.id)
+            ORDER BY id
+            LIMIT %s
+        """, (after_id, limit))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# Function to get the row counts and on-disk sizes, indexes included, of both offer storages
+def get_offer_storage_sizes():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    tables = ['parsed_offers', 'offer_segments', 'offer_itineraries', 'offer_snapshots', 'offer_observations']
+    try:
+        sizes = {}
+        for table in tables:
+            full_table_name = f"{table}_{environment}"
+            cur.execute(f"""
+                SELECT COUNT(*), pg_total_relation_size(%s) FROM {full_table_name}
+            """, (full_table_name,))
+            rows, total_bytes = cur.fetchone()
+            sizes[table] = {'rows': rows, 'bytes': total_bytes}
+        cur.execute(f"""
+            SELECT COALESCE(SUM(jsonb_array_length(data)), 0) FROM parsed_offers_{environment}
+        """)
+        sizes['parsed_offers']['offers'] = cur.fetchone()[0]
+        cur.execute(f"""
+            SELECT COALESCE(SUM(offer_count), 0), COALESCE(SUM(json_bytes), 0), COALESCE(SUM(octet_length(raw_payload)), 0),
+                   COUNT(write_ms), COALESCE(SUM(offer_count) FILTER (WHERE write_ms IS NOT NULL), 0), COALESCE(SUM(write_ms), 0)
+            FROM offer_snapshots_{environment}
+        """)
+        offers, json_bytes, raw_payload_bytes, timed_writes, timed_offers, write_ms = cur.fetchone()
+        sizes['offer_snapshots'].update({
+            'offers': offers, 'json_bytes': json_bytes, 'raw_payload_bytes': raw_payload_bytes,
+            'timed_writes': timed_writes, 'timed_offers': timed_offers, 'write_ms': float(write_ms)
+        })
+        return sizes
+    finally:
+        cur.close()
+        conn.close()
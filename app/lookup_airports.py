@@ -1,27 +1,19 @@
-import pandas as pd
 import streamlit as st
+from reference_data import load_reference_tables, find_airports, find_airport_by_code
 
-# Load the airport data from CSV
-@st.cache_data
+# Load the airport data, memory mapped from the reference bundle or parsed from the CSV
+@st.cache_resource
 def load_airport_data():
-    return pd.read_csv('data/airports.csv')
+    return load_reference_tables()['airports']
 
-# Modify the search_airport function to use the CSV data
+# Modify the search_airport function to use the reference data
 def search_airport(search_term):
-    airports_df = load_airport_data()
-    filtered_airports = airports_df[
-        airports_df['code'].str.contains(search_term.upper()) |
-        airports_df['name'].str.contains(search_term, case=False) |
-        airports_df['city'].str.contains(search_term, case=False) |
-        airports_df['country'].str.contains(search_term, case=False)
-    ]
-    return [f"{row['name']} ({row['code']}), {row['city']}, {row['country']}" for _, row in filtered_airports.iterrows()]
+    airports = load_airport_data()
+    return [f"{airport['name']} ({airport['code']}), {airport['city']}, {airport['country']}" for airport in find_airports(airports, search_term)]
 
 # Function to get simplified airport name from code
 def get_airport_simple_name(code):
-    airports_df = load_airport_data()
-    matching_airports = airports_df[airports_df['code'] == code]
-    if matching_airports.empty:
+    airport = find_airport_by_code(load_airport_data(), code)
+    if airport is None:
         return f"Unknown ({code})"
-    airport = matching_airports.iloc[0]
-    return f"{airport['city']} ({airport['code']})"
\ No newline at end of file
+    return f"{airport['city']} ({airport['code']})"
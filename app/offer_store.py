@@ -0,0 +1,199 @@
+import sys
+import copy
+import json
+import time
+import zlib
+import hashlib
+import toml
+
+from search_offers import summarize_itinerary
+from db_operations import (DateTimeEncoder, create_tables, insert_data, decode_itinerary, insert_offer_snapshot,
+                           get_offer_snapshots, get_offer_snapshot_payload, get_parsed_offer_rows,
+                           get_parsed_offer_batch, get_offer_storage_sizes)
+
+# Storage of the parsed offers of each searched date. In "jsonb" mode every date is one
+# parsed_offers row holding its full offers. In "dedup" mode segments and itineraries are
+# content-addressed: each distinct one is stored once under the hash of its content, and
+# a date only adds a snapshot of price observations pointing to them. Consecutive sweeps
+# of a route mostly see the same flights, so they add little more than prices.
+#   python app/offer_store.py stats      sizes of both storages, space saved and write throughput
+#   python app/offer_store.py migrate    copy the JSONB rows into the deduplicated storage
+
+
+# Function to load the offer storage settings from parameters.toml
+def load_storage_settings(params_config=None):
+    if params_config is None:
+        params_config = toml.load('config/parameters.toml')
+    storage_config = params_config.get('storage', {})
+    return {
+        'parsed_offers_mode': storage_config.get('parsed_offers_mode', 'jsonb'),
+        'keep_raw_payloads': storage_config.get('keep_raw_payloads', False)
+    }
+
+
+def _content_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DateTimeEncoder).encode('utf-8')).hexdigest()
+
+
+# Function to split parsed offers into their distinct segments and itineraries by content hash,
+# and one (price, currency, itinerary hashes) observation per offer
+def split_offers(parsed_offers):
+    segments = {}
+    itineraries = {}
+    observations = []
+    for offer in parsed_offers:
+        itinerary_hashes = []
+        for itinerary in offer['itineraries']:
+            segment_hashes = []
+            for segment in itinerary['segments']:
+                segment_hash = _content_hash(segment)
+                segments[segment_hash] = segment
+                segment_hashes.append(segment_hash)
+            # The itinerary summary without its segments, which are referenced by hash
+            summary = {key: value for key, value in itinerary.items() if key != 'segments'}
+            itinerary_hash = _content_hash({'segment_hashes': segment_hashes, **summary})
+            itineraries[itinerary_hash] = (segment_hashes, summary)
+            itinerary_hashes.append(itinerary_hash)
+        observations.append((offer['price'], offer['currency'], itinerary_hashes))
+    return segments, itineraries, observations
+
+
+# Function to bring a stored parsed offer back to the format of parse_offers: datetimes decoded,
+# and travel times and stops summarized for offers recorded before they were precomputed
+def complete_offer(parsed_offer):
+    for itinerary in parsed_offer['itineraries']:
+        decode_itinerary(itinerary)
+        if 'duration_minutes' not in itinerary:
+            itinerary.update(summarize_itinerary(itinerary))
+    parsed_offer['total_duration_minutes'] = sum(itinerary['duration_minutes'] for itinerary in parsed_offer['itineraries'])
+    parsed_offer['total_stops'] = sum(itinerary['stops'] for itinerary in parsed_offer['itineraries'])
+    parsed_offer['layover_minutes'] = sum(itinerary['layover_minutes'] for itinerary in parsed_offer['itineraries'])
+    return parsed_offer
+
+
+# Function to rebuild parsed offers, in the format of parse_offers, from observations and
+# the itineraries and segments they point to
+def assemble_offers(observations, itineraries, segments):
+    parsed_offers = []
+    for price, currency, itinerary_hashes in observations:
+        parsed_offer = {'price': price, 'currency': currency, 'itineraries': []}
+        for itinerary_hash in itinerary_hashes:
+            segment_hashes, summary = itineraries[itinerary_hash]
+            # Copies, so offers sharing a segment do not share its dict
+            parsed_offer['itineraries'].append(
+                {'segments': [copy.deepcopy(segments[segment_hash]) for segment_hash in segment_hashes], **summary}
+            )
+        parsed_offers.append(complete_offer(parsed_offer))
+    return parsed_offers
+
+
+# Function to record the parsed offers of one date of a search with the configured storage mode.
+# With keep_raw_payloads, the raw API response is kept zlib-compressed in the deduplicated storage.
+# source_id is the parsed_offers row the offers are migrated from, if any.
+def record_parsed_offers(parsed_offers, search_inputs_id, settings, offers_data=None, created_at=None, source_id=None):
+    start = time.perf_counter()
+    if settings.get('parsed_offers_mode', 'jsonb') != 'dedup':
+        record_id = insert_data(parsed_offers, 'parsed_offers', search_inputs_id)
+        print(f"{len(parsed_offers)} offers written as JSONB in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+        return record_id
+
+    json_bytes = len(json.dumps(parsed_offers, cls=DateTimeEncoder))
+    segments, itineraries, observations = split_offers(parsed_offers)
+    raw_payload = None
+    if settings.get('keep_raw_payloads') and offers_data is not None:
+        raw_payload = zlib.compress(json.dumps(offers_data).encode('utf-8'))
+    snapshot_id, new_segments, new_itineraries = insert_offer_snapshot(
+        search_inputs_id, segments, itineraries, observations, json_bytes, raw_payload, created_at,
+        source_id=source_id, prepare_ms=(time.perf_counter() - start) * 1000
+    )
+    if snapshot_id is not None:
+        print(f"{len(parsed_offers)} offers written to snapshot {snapshot_id} in {(time.perf_counter() - start) * 1000:.1f} ms, "
+              f"{new_segments} new segments, {new_itineraries} new itineraries", file=sys.stderr)
+    return snapshot_id
+
+
+# Function to get the parsed offers recorded for a search, in the format of parse_offers:
+# one list of offers per recorded date, oldest first, from both storage modes
+def get_parsed_offers(search_inputs_id):
+    recorded = []
+    for _, created_at, data in get_parsed_offer_rows(search_inputs_id):
+        recorded.append((created_at, [complete_offer(offer) for offer in data]))
+
+    snapshots, itineraries, segments = get_offer_snapshots(search_inputs_id)
+    for _, created_at, observations in snapshots:
+        recorded.append((created_at, assemble_offers(observations, itineraries, segments)))
+
+    recorded.sort(key=lambda entry: entry[0])
+    return [parsed_offers for _, parsed_offers in recorded]
+
+
+# Function to get the raw API response kept with an offer snapshot, or None
+def get_raw_payload(snapshot_id):
+    raw_payload = get_offer_snapshot_payload(snapshot_id)
+    if raw_payload is None:
+        return None
+    return json.loads(zlib.decompress(raw_payload).decode('utf-8'))
+
+
+# Function to report the sizes of both storages, the space the deduplicated storage saves over
+# JSONB rows and its write throughput. Both storages are compared on disk, indexes included, per offer:
+# the JSONB rows are the ones of the JSONB storage, migrated or not.
+def get_storage_report():
+    sizes = get_offer_storage_sizes()
+    dedup_tables = ['offer_segments', 'offer_itineraries', 'offer_snapshots', 'offer_observations']
+    dedup_bytes = sum(sizes[table]['bytes'] for table in dedup_tables)
+    jsonb = sizes['parsed_offers']
+    snapshots = sizes['offer_snapshots']
+
+    jsonb_bytes_per_offer = jsonb['bytes'] / jsonb['offers'] if jsonb['offers'] else None
+    dedup_bytes_per_offer = dedup_bytes / snapshots['offers'] if snapshots['offers'] else None
+    space_saved_percent = None
+    if jsonb_bytes_per_offer and dedup_bytes_per_offer:
+        space_saved_percent = round(100 * (1 - dedup_bytes_per_offer / jsonb_bytes_per_offer), 1)
+
+    write_seconds = snapshots['write_ms'] / 1000
+    return {
+        'tables': sizes,
+        'dedup_bytes': dedup_bytes,
+        'jsonb_bytes_per_offer': round(jsonb_bytes_per_offer) if jsonb_bytes_per_offer else None,
+        'dedup_bytes_per_offer': round(dedup_bytes_per_offer) if dedup_bytes_per_offer else None,
+        'space_saved_percent': space_saved_percent,
+        'dedup_writes': snapshots['timed_writes'],
+        'dedup_write_seconds': round(write_seconds, 3),
+        'dedup_offers_per_second': round(snapshots['timed_offers'] / write_seconds, 1) if write_seconds else None
+    }
+
+
+# Function to copy the parsed offers recorded as JSONB into the deduplicated storage, in batches.
+# The JSONB rows are kept, truncate parsed_offers once the copy is checked. Each snapshot records
+# the row it was copied from, so migrated rows are skipped by get_parsed_offers and by later runs.
+def migrate_parsed_offers(batch_size=500, settings=None):
+    settings = {**(settings or {}), 'parsed_offers_mode': 'dedup'}
+    after_id = 0
+    migrated = 0
+    while True:
+        rows = get_parsed_offer_batch(after_id, batch_size)
+        if not rows:
+            break
+        for record_id, search_inputs_id, created_at, data in rows:
+            for offer in data:
+                for itinerary in offer['itineraries']:
+                    decode_itinerary(itinerary)
+            record_parsed_offers(data, search_inputs_id, settings, created_at=created_at, source_id=record_id)
+            after_id = record_id
+            migrated += 1
+        print(f"{migrated} parsed offer rows migrated", file=sys.stderr)
+    return migrated
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    create_tables()
+    if command == 'stats':
+        print(json.dumps(get_storage_report(), indent=2, default=str))
+    elif command == 'migrate':
+        migrate_parsed_offers()
+        print(json.dumps(get_storage_report(), indent=2, default=str))
+    else:
+        print(f"Unknown command: {command}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,216 @@
+import sys
+import time
+import math
+import argparse
+from datetime import datetime, date, timedelta
+import toml
+
+from search_offers import get_access_token, get_departure_dates
+from db_operations import (create_tables, get_sweep_key, get_watched_searches, get_price_history, get_checkpoint_prices,
+                           insert_observation, get_watcher_requests_last_hour, save_watcher_run, get_watcher_runs)
+from sweep import environment, DAY_MAPPING, get_api_settings, load_sweep_settings, fetch_offers, process_offers
+
+# Price watcher: re-checks the dates of stored searches for price drops within a
+# global budget of API requests per hour, spending it on the dates that matter most:
+# near departures, dates with large recent price swings and dates not checked for long.
+#   python app/price_watcher.py          run forever, one cycle every cycle_minutes
+#   python app/price_watcher.py --once   run a single cycle
+#   python app/price_watcher.py --status show the latest cycles, their budget use and decisions
+
+
+# Function to load the price watcher settings from parameters.toml
+def load_watcher_settings(params_config=None):
+    if params_config is None:
+        params_config = toml.load('config/parameters.toml')
+    watcher_config = params_config.get('watcher', {})
+    return {
+        'requests_per_hour': watcher_config.get('requests_per_hour', 100),
+        'cycle_minutes': watcher_config.get('cycle_minutes', 10),
+        'lookback_days': watcher_config.get('lookback_days', 30),
+        'min_recheck_hours': watcher_config.get('min_recheck_hours', 6),
+        'staleness_horizon_hours': watcher_config.get('staleness_horizon_hours', 72),
+        'drop_threshold_percent': watcher_config.get('drop_threshold_percent', 10),
+        'nearness_weight': watcher_config.get('nearness_weight', 1.0),
+        'volatility_weight': watcher_config.get('volatility_weight', 1.0),
+        'staleness_weight': watcher_config.get('staleness_weight', 1.0)
+    }
+
+
+# Function to score how urgently a date should be re-checked, from 0 (not at all) upwards.
+# A date the watcher has not observed is aged from its latest sweep checkpoint, checkpoint_hours ago, if any.
+def score_task(departure_date, history, settings, today, checkpoint_hours=None):
+    # Near departures first: 1 for tomorrow, 0.5 a week out, ...
+    nearness = 1 / (1 + max((departure_date - today).days - 1, 0) / 7)
+
+    prices = [price for price, _ in history if price is not None]
+    if len(prices) >= 2:
+        # Relative price range over the recent observations, capped at 1
+        volatility = min((max(prices) - min(prices)) / (sum(prices) / len(prices)), 1.0)
+    else:
+        volatility = 0.0
+
+    if history:
+        hours_since_check = history[0][1]
+    elif checkpoint_hours is not None:
+        hours_since_check = checkpoint_hours
+    else:
+        hours_since_check = math.inf  # Never checked
+    staleness = min(hours_since_check / settings['staleness_horizon_hours'], 1.0)
+
+    score = (settings['nearness_weight'] * nearness
+             + settings['volatility_weight'] * volatility
+             + settings['staleness_weight'] * staleness)
+    return score, {
+        'nearness': round(nearness, 3),
+        'volatility': round(volatility, 3),
+        'staleness': round(staleness, 3),
+        'hours_since_check': None if math.isinf(hours_since_check) else round(hours_since_check, 1)
+    }
+
+
+# Function to list the future dates of the watched searches, ranked by priority. Dates the watcher
+# has not observed yet are compared against the price of the user's own sweep, and aged from the
+# time of the sweep, from its checkpoints: (price, hours ago) per (search key, departure date).
+def plan_tasks(searches, history, settings, today, checkpoints=None):
+    checkpoints = checkpoints or {}
+    tasks = []
+    for search_inputs_id, search_inputs in searches:
+        search_key = get_sweep_key(search_inputs)
+        try:
+            start_date = max(datetime.strptime(search_inputs['start_date'], '%Y-%m-%d').date(), today + timedelta(days=1))
+            end_date = datetime.strptime(search_inputs['end_date'], '%Y-%m-%d').date()
+            departure_weekday = DAY_MAPPING[search_inputs['departure_day']]
+        except (KeyError, ValueError) as e:
+            print(f"Skipping stored search {search_inputs_id}: {e}", file=sys.stderr)
+            continue
+
+        for departure_date in get_departure_dates(start_date, end_date, departure_weekday):
+            date_history = history.get((search_key, departure_date), [])
+            checkpoint_price, checkpoint_hours = checkpoints.get((search_key, departure_date), (None, None))
+            score, components = score_task(departure_date, date_history, settings, today, checkpoint_hours)
+            # Dates checked very recently are not worth a request yet
+            if components['hours_since_check'] is not None and components['hours_since_check'] < settings['min_recheck_hours']:
+                continue
+            tasks.append({
+                'search_key': search_key,
+                'search_inputs_id': search_inputs_id,
+                'search_inputs': search_inputs,
+                'departure_date': departure_date,
+                'previous_price': next((price for price, _ in date_history if price is not None), checkpoint_price),
+                'score': round(score, 3),
+                **components
+            })
+    tasks.sort(key=lambda task: task['score'], reverse=True)
+    return tasks
+
+
+# Function to get the number of requests a cycle may spend: its share of the hourly budget,
+# limited by what all watchers have used in the last hour
+def get_cycle_budget(settings):
+    cycle_share = math.ceil(settings['requests_per_hour'] * settings['cycle_minutes'] / 60)
+    remaining = settings['requests_per_hour'] - get_watcher_requests_last_hour()
+    return max(min(cycle_share, remaining), 0)
+
+
+# Function to run one cycle: plan, then re-check the highest priority dates within the budget
+def run_cycle(settings, sweep_settings):
+    today = date.today()
+
+    searches = get_watched_searches(settings['lookback_days'])
+    search_keys = [get_sweep_key(search_inputs) for _, search_inputs in searches]
+    history = get_price_history(search_keys)
+    tasks = plan_tasks(searches, history, settings, today, get_checkpoint_prices(search_keys))
+    budget = get_cycle_budget(settings)
+
+    chosen = tasks[:budget]
+    decisions = [
+        {
+            'departure_date': task['departure_date'].strftime('%Y-%m-%d'),
+            **{key: task[key] for key in ('search_inputs_id', 'score', 'nearness', 'volatility', 'staleness', 'hours_since_check')}
+        }
+        for task in chosen
+    ]
+    run_id = save_watcher_run(budget, len(tasks), decisions)
+    print(f"Watcher cycle {run_id}: {len(searches)} searches, {len(tasks)} candidate dates, budget {budget}", file=sys.stderr)
+    if not chosen:
+        return run_id
+
+    api_url, api_key, api_secret = get_api_settings()
+    access_token = get_access_token(api_key, api_secret, api_url)
+
+    requests_used = 0
+    for task, decision in zip(chosen, decisions):
+        search_inputs = task['search_inputs']
+        departure_date_str = task['departure_date'].strftime('%Y-%m-%d')
+        return_date_str = (task['departure_date'] + timedelta(days=int(search_inputs['number_of_nights']))).strftime('%Y-%m-%d')
+
+        try:
+            requests_used += 1
+            offers_data = fetch_offers(access_token, search_inputs, departure_date_str, return_date_str, api_url, sweep_settings)
+            flight_price = process_offers(offers_data, search_inputs, task['search_inputs_id'], departure_date_str, return_date_str, sweep_settings)
+        except Exception as e:
+            print(f"Watcher error for {search_inputs['origin']}-{search_inputs['destination']} on {departure_date_str}: {e}", file=sys.stderr)
+            decision['error'] = str(e)
+            if '429' in str(e):
+                break  # Out of quota, leave the rest for the next cycle
+            continue
+
+        # Flag prices that dropped by more than the threshold since the previous observation
+        price = flight_price['price'] if flight_price else None
+        previous_price = task['previous_price']
+        is_drop = (price is not None and previous_price is not None
+                   and price <= previous_price * (1 - settings['drop_threshold_percent'] / 100))
+        insert_observation(task['search_key'], task['search_inputs_id'], task['departure_date'], flight_price, previous_price, is_drop)
+
+        decision['price'] = price
+        decision['is_drop'] = is_drop
+        if is_drop:
+            print(f"Price drop: {search_inputs['origin']}-{search_inputs['destination']} on {departure_date_str} "
+                  f"from {previous_price} to {price} {flight_price['currency']}", file=sys.stderr)
+
+        # Keep the used budget visible to other watchers as it is spent
+        save_watcher_run(budget, len(tasks), decisions, requests_used, run_id)
+
+        # Pause to respect rate limit
+        time.sleep(0.5 if environment == "test" else 0.05)
+
+    save_watcher_run(budget, len(tasks), decisions, requests_used, run_id)
+    print(f"Watcher cycle {run_id} done: {requests_used} of {budget} requests used", file=sys.stderr)
+    return run_id
+
+
+# Function to print the latest cycles: budget, requests used and the dates chosen with their scores
+def print_status(limit=10):
+    for run in get_watcher_runs(limit):
+        print(f"Cycle {run['id']} started {run['started_at']:%Y-%m-%d %H:%M}: "
+              f"{run['requests_used']} of {run['budget']} requests used, {run['candidates']} candidate dates")
+        for decision in run['decisions'] or []:
+            outcome = decision.get('error') or (f"price {decision['price']}" if 'price' in decision else "not checked")
+            drop = " PRICE DROP" if decision.get('is_drop') else ""
+            print(f"  search {decision['search_inputs_id']} {decision['departure_date']} "
+                  f"score {decision['score']}: {outcome}{drop}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-check stored searches for price drops")
+    parser.add_argument('--once', action='store_true', help="Run a single cycle and exit")
+    parser.add_argument('--status', action='store_true', help="Show the latest cycles and exit")
+    args = parser.parse_args()
+
+    # Ensure tables exist
+    create_tables()
+
+    if args.status:
+        print_status()
+        sys.exit(0)
+
+    watcher_settings = load_watcher_settings()
+    sweep_settings = load_sweep_settings()
+    while True:
+        try:
+            run_cycle(watcher_settings, sweep_settings)
+        except Exception as e:
+            print(f"Watcher cycle failed: {e}", file=sys.stderr)
+        if args.once:
+            break
+        time.sleep(watcher_settings['cycle_minutes'] * 60)
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+
+# Airport and airline reference data compiled from the CSVs in data/ into a
+# binary bundle of numpy arrays. The bundle is memory mapped on load, so all
+# app processes on a host share one physical copy through the page cache.
+# The CSVs stay the source of truth: a missing or stale bundle falls back to them.
+
+AIRPORTS_CSV = os.path.join('data', 'airports.csv')
+AIRLINES_CSV = os.path.join('data', 'airlines.csv')
+BUNDLE_DIR = os.path.join('data', 'bundle')
+BUNDLE_VERSION = 1
+
+AIRPORT_FIELDS = ['code', 'name', 'city', 'country']
+AIRLINE_FIELDS = ['IATA', 'Name', 'url']
+
+
+def _encode_column(values):
+    # Fixed-width UTF-8 byte strings, wide enough for the longest value
+    encoded = [str(value).encode('utf-8') if value == value else b'' for value in values]
+    width = max([len(value) for value in encoded] + [1])
+    return np.array(encoded, dtype=f'S{width}')
+
+
+def _build_table(df, fields, key_field):
+    table = {field: _encode_column(df[field]) for field in fields}
+    # Sort all columns by the key so lookups can use binary search
+    order = np.argsort(table[key_field], kind='stable')
+    return {field: column[order] for field, column in table.items()}
+
+
+def _build_airport_search_text(airports):
+    # Search index: lowercase "code|name|city|country" per airport
+    parts = [np.char.lower(np.char.decode(airports[field], 'utf-8')) for field in AIRPORT_FIELDS]
+    search_text = parts[0]
+    for part in parts[1:]:
+        search_text = np.char.add(np.char.add(search_text, '|'), part)
+    return _encode_column(search_text)
+
+
+def _build_reference_tables(airports_csv=AIRPORTS_CSV, airlines_csv=AIRLINES_CSV):
+    import pandas as pd  # Only needed when compiling from the CSVs
+
+    airports = _build_table(pd.read_csv(airports_csv, keep_default_na=False), AIRPORT_FIELDS, 'code')
+    airports['search_text'] = _build_airport_search_text(airports)
+    airlines = _build_table(pd.read_csv(airlines_csv, keep_default_na=False), AIRLINE_FIELDS, 'IATA')
+    return {'airports': airports, 'airlines': airlines}
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Function to compile the reference CSVs into the binary bundle
+def build_reference_bundle(airports_csv=AIRPORTS_CSV, airlines_csv=AIRLINES_CSV, bundle_dir=BUNDLE_DIR):
+    tables = _build_reference_tables(airports_csv, airlines_csv)
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    for table_name, columns in tables.items():
+        for field, column in columns.items():
+            np.save(os.path.join(bundle_dir, f"{table_name}.{field}.npy"), column)
+
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'sources': {
+            'airports': _source_signature(airports_csv),
+            'airlines': _source_signature(airlines_csv)
+        },
+        'rows': {table_name: len(next(iter(columns.values()))) for table_name, columns in tables.items()}
+    }
+    with open(os.path.join(bundle_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Reference bundle written to {bundle_dir}: {manifest['rows']}", file=sys.stderr)
+    return manifest
+
+
+def _bundle_is_current(bundle_dir, sources):
+    try:
+        with open(os.path.join(bundle_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest.get('version') != BUNDLE_VERSION:
+        return False
+    return all(manifest['sources'].get(name) == _source_signature(path) for name, path in sources.items())
+
+
+def _load_bundle_table(bundle_dir, table_name, fields):
+    return {
+        field: np.load(os.path.join(bundle_dir, f"{table_name}.{field}.npy"), mmap_mode='r')
+        for field in fields
+    }
+
+
+# Function to load the reference tables, memory mapped from the bundle when it is up to date
+def load_reference_tables(airports_csv=AIRPORTS_CSV, airlines_csv=AIRLINES_CSV, bundle_dir=BUNDLE_DIR):
+    sources = {'airports': airports_csv, 'airlines': airlines_csv}
+    if _bundle_is_current(bundle_dir, sources):
+        try:
+            return {
+                'airports': _load_bundle_table(bundle_dir, 'airports', AIRPORT_FIELDS + ['search_text']),
+                'airlines': _load_bundle_table(bundle_dir, 'airlines', AIRLINE_FIELDS)
+            }
+        except (OSError, ValueError) as e:
+            print(f"Error loading reference bundle, falling back to CSV: {e}", file=sys.stderr)
+    else:
+        print(f"Reference bundle in {bundle_dir} missing or stale, parsing CSVs", file=sys.stderr)
+    return _build_reference_tables(airports_csv, airlines_csv)
+
+
+def _decode(value):
+    return value.decode('utf-8')
+
+
+def _row(table, fields, index):
+    return {field: _decode(table[field][index]) for field in fields}
+
+
+# Function to get the airports whose code, name, city or country contain the search term
+def find_airports(airports, search_term):
+    term = search_term.lower().encode('utf-8')
+    matches = np.flatnonzero(np.char.find(airports['search_text'], term) >= 0)
+    return [_row(airports, AIRPORT_FIELDS, index) for index in matches]
+
+
+# Function to get an airport by its IATA code using the sorted code index
+def find_airport_by_code(airports, code):
+    key = str(code).encode('utf-8')
+    index = np.searchsorted(airports['code'], key)
+    if index < len(airports['code']) and airports['code'][index] == key:
+        return _row(airports, AIRPORT_FIELDS, index)
+    return None
+
+
+# Function to get the airports of a city, matching its name without regard to case
+def find_airports_by_city(airports, city):
+    cities = np.char.lower(np.char.decode(airports['city'], 'utf-8'))
+    matches = np.flatnonzero(cities == str(city).lower())
+    return [_row(airports, AIRPORT_FIELDS, index) for index in matches]
+
+
+# Function to get a lookup of airline name and URL by IATA code
+def get_airlines_dict(airlines):
+    return {
+        _decode(iata): {'name': _decode(name), 'url': _decode(url)}
+        for iata, name, url in zip(airlines['IATA'], airlines['Name'], airlines['url'])
+    }
+
+
+def _read_memory_kb():
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty', 'Shared_Clean'):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        pass  # Memory breakdown is only available on Linux
+    return memory
+
+
+def _measure_cold_start(mode):
+    # Runs in a fresh interpreter: load the tables the way the app does and run one search.
+    # The app imports pandas either way, so both modes import it before measuring the tables.
+    import pandas as pd
+    baseline = _read_memory_kb()
+
+    if mode == 'csv':
+        airports_df = pd.read_csv(AIRPORTS_CSV)
+        airlines_df = pd.read_csv(AIRLINES_CSV)
+        airports_df[airports_df['city'].str.contains('zurich', case=False)]
+        len(airlines_df)
+    else:
+        tables = load_reference_tables()
+        find_airports(tables['airports'], 'zurich')
+
+    memory = _read_memory_kb()
+    # Footprint of the reference tables alone, on top of the interpreter and pandas
+    tables_memory = {key: memory[key] - baseline.get(key, 0) for key in memory}
+    print(json.dumps({'mode': mode, 'memory_kb': memory, 'tables_memory_kb': tables_memory}))
+
+
+# Function to compare cold-start time and memory of CSV parsing against the bundle
+def benchmark_cold_start(runs=5):
+    results = {}
+    for mode in ('csv', 'bundle'):
+        samples = []
+        for _ in range(runs):
+            # Time the whole process, including interpreter start and imports
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '_measure', mode],
+                capture_output=True, text=True, check=True
+            )
+            sample = json.loads(output.stdout.strip().splitlines()[-1])
+            sample['seconds'] = time.perf_counter() - start
+            samples.append(sample)
+        results[mode] = {
+            'median_seconds': sorted(sample['seconds'] for sample in samples)[runs // 2],
+            'memory_kb': samples[-1]['memory_kb'],
+            'tables_memory_kb': samples[-1]['tables_memory_kb']
+        }
+        print(f"{mode}: {results[mode]}", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python app/reference_data.py build | benchmark
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        build_reference_bundle()
+    elif command == 'benchmark':
+        benchmark_cold_start()
+    elif command == '_measure':
+        _measure_cold_start(sys.argv[2])
+    else:
+        print(f"Unknown command: {command}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,90 @@
+import sys
+import zlib
+import pickle
+import threading
+from collections import OrderedDict
+
+# Process-wide store of search results shared by all Streamlit sessions. Sessions
+# keep only the key of their results; the values are held compressed, within a
+# per-session and a global memory cap, evicting the least recently used first.
+# Evicted values are rebuilt on demand by the caller's rebuild function.
+
+
+class ResultStore:
+    def __init__(self, max_bytes_per_session, max_bytes_total):
+        self.max_bytes_per_session = max_bytes_per_session
+        self.max_bytes_total = max_bytes_total
+        self._entries = OrderedDict()  # key -> (session_id, compressed value), least recently used first
+        self._session_bytes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'rebuilds': 0, 'evictions': 0}
+
+    def _remove(self, key):
+        session_id, blob = self._entries.pop(key)
+        self._total_bytes -= len(blob)
+        self._session_bytes[session_id] -= len(blob)
+        if not self._session_bytes[session_id]:
+            del self._session_bytes[session_id]
+
+    def _evict(self, session_id):
+        # Oldest entries of the session first, then oldest entries overall
+        evictions = self.stats['evictions']
+        for key in [key for key, (owner, _) in self._entries.items() if owner == session_id]:
+            if self._session_bytes.get(session_id, 0) <= self.max_bytes_per_session:
+                break
+            self._remove(key)
+            self.stats['evictions'] += 1
+        while self._total_bytes > self.max_bytes_total and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+        return self.stats['evictions'] - evictions
+
+    # Store a value for a session under a key, replacing any previous value of the key
+    def put(self, session_id, key, value):
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if len(blob) > min(self.max_bytes_per_session, self.max_bytes_total):
+            print(f"Result {key} ({len(blob)} bytes) exceeds the result store caps, not stored", file=sys.stderr)
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (session_id, blob)
+            self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + len(blob)
+            self._total_bytes += len(blob)
+            evicted = self._evict(session_id)
+        # The store is at its caps: report how it is used
+        if evicted:
+            print(f"Result store evicted {evicted} entries, usage: {self.get_usage()}", file=sys.stderr)
+
+    # Get the value of a key, rebuilding and storing it with rebuild() if it was evicted.
+    # Returns None when the key is unknown and there is no way to rebuild it.
+    def get(self, key, session_id=None, rebuild=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+        if entry is not None:
+            return pickle.loads(zlib.decompress(entry[1]))
+
+        if rebuild is None:
+            return None
+        value = rebuild()
+        if value is not None:
+            with self._lock:
+                self.stats['rebuilds'] += 1
+            self.put(session_id, key, value)
+        return value
+
+    # Get the memory use of the store
+    def get_usage(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'sessions': len(self._session_bytes),
+                'total_bytes': self._total_bytes,
+                **self.stats
+            }
@@ -0,0 +1,131 @@
+import sys
+
+from search_offers import get_direct_destinations
+from reference_data import load_reference_tables, find_airport_by_code, find_airports_by_city
+from db_operations import create_tables, upsert_direct_routes, mark_route_origin_fetched, get_direct_routes, rebuild_observed_routes
+
+# Local graph of the direct connections between airports, used to catch direct-flight
+# searches on routes without direct service before a request is spent on every date.
+# It is filled from the direct itineraries of recorded offers and, optionally, from the
+# Amadeus airport routes endpoint; entries older than the TTL are ignored.
+# Observed offers only ever prove that a route exists: a route is known not to exist
+# only once the complete list of direct destinations of its origin has been fetched,
+# so the check can only warn about or reject searches with the endpoint enabled.
+
+_airports = None
+
+
+def _load_airports():
+    global _airports
+    if _airports is None:
+        _airports = load_reference_tables()['airports']
+    return _airports
+
+
+# Function to get the (origin, destination) pairs of the single-segment itineraries of parsed offers
+def get_direct_pairs(parsed_offers):
+    pairs = set()
+    for offer in parsed_offers:
+        for itinerary in offer['itineraries']:
+            segments = itinerary['segments']
+            if len(segments) == 1:
+                pairs.add((segments[0]['departure']['iataCode'], segments[0]['arrival']['iataCode']))
+    return pairs
+
+
+# Function to record the direct connections seen in parsed offers
+def record_observed_routes(parsed_offers):
+    try:
+        upsert_direct_routes(sorted(get_direct_pairs(parsed_offers)), 'observed')
+    except Exception as e:
+        print(f"Error recording observed routes: {e}", file=sys.stderr)
+
+
+# Function to turn the (city code, city name) destinations of the routes endpoint into airport codes:
+# the city code itself, which is also the airport code of single-airport cities, and every airport
+# of a city with that name
+def get_destination_airports(destinations):
+    airports = _load_airports()
+    codes = set()
+    for city_code, city_name in destinations:
+        codes.add(city_code)
+        if city_name:
+            codes.update(airport['code'] for airport in find_airports_by_city(airports, city_name))
+    return codes
+
+
+# Function to fetch and record the complete list of direct destinations of an origin
+def refresh_origin(access_token, origin, api_url):
+    destinations = get_destination_airports(get_direct_destinations(access_token, origin, api_url))
+    upsert_direct_routes([(origin, destination) for destination in sorted(destinations)], 'endpoint')
+    mark_route_origin_fetched(origin)
+    print(f"{len(destinations)} direct destination airports recorded for {origin}", file=sys.stderr)
+    return destinations
+
+
+# Function to tell whether an airport shares its city with other airports, for which a missing
+# endpoint entry is no proof: the endpoint may list the city under a name the reference data spells differently
+def is_multi_airport_city(code):
+    airports = _load_airports()
+    airport = find_airport_by_code(airports, code)
+    if airport is None:
+        return True  # Unknown airport, no conclusion either
+    return len([other for other in find_airports_by_city(airports, airport['city'])
+                if other['country'] == airport['country']]) > 1
+
+
+# Function to check one direction of a route: True if known, False if known not to exist, None if unknown
+def _check_direct_leg(origin, destination, settings, access_token, api_url):
+    destinations, complete = get_direct_routes(origin, settings['route_ttl_hours'])
+    if destination in destinations:
+        return True
+
+    if not complete and settings['route_endpoint'] and access_token:
+        try:
+            refresh_origin(access_token, origin, api_url)
+        except Exception as e:
+            print(f"Error fetching direct destinations of {origin}: {e}", file=sys.stderr)
+            return None
+        destinations, complete = get_direct_routes(origin, settings['route_ttl_hours'])
+        if destination in destinations:
+            return True
+
+    if not complete or is_multi_airport_city(destination):
+        return None
+    return False
+
+
+# Function to check whether direct flights exist both ways between origin and destination:
+# True if known, False if either way is known not to exist, None if unknown. With the endpoint
+# enabled, airports without a fresh destination list are refreshed first.
+def check_direct_route(origin, destination, settings, access_token=None, api_url=None):
+    legs = [_check_direct_leg(origin, destination, settings, access_token, api_url),
+            _check_direct_leg(destination, origin, settings, access_token, api_url)]
+    if False in legs:
+        return False
+    if all(legs):
+        return True
+    return None
+
+
+# Function to get the destinations known to be served by direct flights from an origin
+def get_reachable_destinations(origin, settings):
+    destinations, _ = get_direct_routes(origin, settings['route_ttl_hours'])
+    return sorted(destinations)
+
+
+if __name__ == "__main__":
+    # Usage: python app/route_graph.py rebuild | refresh ORIGIN
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    create_tables()
+    if command == 'rebuild':
+        # Learn the direct routes of all offers recorded so far
+        rebuild_observed_routes()
+    elif command == 'refresh' and len(sys.argv) > 2:
+        from search_offers import get_access_token
+        from sweep import get_api_settings
+        api_url, api_key, api_secret = get_api_settings()
+        refresh_origin(get_access_token(api_key, api_secret, api_url), sys.argv[2].upper(), api_url)
+    else:
+        print(f"Unknown command: {' '.join(sys.argv[1:])}", file=sys.stderr)
+        sys.exit(1)
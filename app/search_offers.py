@@ -1,9 +1,14 @@
 import requests
 from datetime import datetime, timedelta, time
 import re
+import json
+import threading
 
 # All functions required to identify cheapest offers on a given day and route
 
+# Timeout of the upstream calls, so a hung connection fails instead of blocking the sweep
+REQUEST_TIMEOUT_SECONDS = 30
+
 # Function to get an access token from the Amadeus API
 def get_access_token(api_key, api_secret, api_url):
     url = f"{api_url}/v1/security/oauth2/token"
@@ -13,7 +18,7 @@ def get_access_token(api_key, api_secret, api_url):
         'client_secret': api_secret
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    response = requests.post(url, data=payload, headers=headers)
+    response = requests.post(url, data=payload, headers=headers, timeout=REQUEST_TIMEOUT_SECONDS)
 
     if response.status_code == 200:
         return response.json()['access_token']
@@ -21,21 +26,193 @@ def get_access_token(api_key, api_secret, api_url):
         raise Exception(f"Error: {response.status_code} - {response.text}")
 
 
+# Single-flight coalescing: concurrent identical offer requests from any session
+# in this process share one upstream call and all receive its result. Followers
+# wait for the leader at most this long, then make their own call.
+COALESCED_WAIT_SECONDS = 2 * REQUEST_TIMEOUT_SECONDS
+_in_flight_requests = {}
+_in_flight_lock = threading.Lock()
+coalescing_stats = {'upstream_calls': 0, 'coalesced_calls': 0, 'wait_timeouts': 0}
+
+
+class _InFlightRequest:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _single_flight(key, fetch):
+    with _in_flight_lock:
+        request = _in_flight_requests.get(key)
+        is_leader = request is None
+        if is_leader:
+            request = _InFlightRequest()
+            _in_flight_requests[key] = request
+            coalescing_stats['upstream_calls'] += 1
+        else:
+            coalescing_stats['coalesced_calls'] += 1
+
+    if not is_leader:
+        if not request.done.wait(COALESCED_WAIT_SECONDS):
+            # The leader's call is stuck: do not share its fate, make an own call,
+            # which saved nothing
+            with _in_flight_lock:
+                coalescing_stats['wait_timeouts'] += 1
+                coalescing_stats['coalesced_calls'] -= 1
+                coalescing_stats['upstream_calls'] += 1
+            return fetch()
+    else:
+        try:
+            request.result = fetch()
+        except Exception as e:
+            request.error = e
+        finally:
+            # Later requests start a fresh upstream call instead of reusing this result
+            with _in_flight_lock:
+                del _in_flight_requests[key]
+            request.done.set()
+
+    if request.error is not None:
+        raise request.error
+    return request.result
+
+
+# Function to get a snapshot of the upstream calls made and saved by coalescing
+def get_coalescing_stats():
+    with _in_flight_lock:
+        return dict(coalescing_stats)
+
+
 # Function to get offers from the Amadeus API
-def get_offers(access_token, origin, destination, departure_date, return_date, non_stop, travel_class, api_url):
+def get_offers(access_token, origin, destination, departure_date, return_date, non_stop, travel_class, api_url, max_offers=50):
     params = {
         'originLocationCode': origin,
         'destinationLocationCode': destination,
         'departureDate': departure_date,
         'returnDate': return_date,
         'adults': 1,
-        'max': 50,  
+        'max': max_offers,
         'nonStop': non_stop,
         'travelClass': travel_class
 
     }
+
+    def fetch():
+        headers = {'Authorization': f'Bearer {access_token}'}
+        response = requests.get(f"{api_url}/v2/shopping/flight-offers", headers=headers, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"Error: {response.status_code} - {response.text}")
+
+    key = ('GET', api_url) + tuple(sorted(params.items()))
+    return _single_flight(key, fetch)
+
+
+# Departure time windows of the time options, as a centre time and a +/- window
+# for the departureDateTimeRange of the POST search (option 0 is "Any")
+TIME_WINDOWS = {
+    1: ('06:00:00', '6H'),  # Morning (midnight to noon)
+    2: ('18:00:00', '6H'),  # Afternoon and evening (noon to midnight)
+    3: ('21:00:00', '3H')   # Evening (6pm to midnight)
+}
+
+
+def _departure_date_time_range(date, time_option):
+    date_time_range = {'date': date}
+    if time_option in TIME_WINDOWS:
+        date_time_range['time'], date_time_range['timeWindow'] = TIME_WINDOWS[time_option]
+    return date_time_range
+
+
+# Function to get offers from the Amadeus API using the POST search, which lets the
+# server filter on departure time windows, maximum price and carriers
+def get_offers_post(access_token, origin, destination, departure_date, return_date, non_stop, travel_class, api_url,
+                    departure_time_option=0, return_time_option=0, max_offers=50, max_price=None,
+                    included_carriers=None, excluded_carriers=None):
+    flight_filters = {
+        'cabinRestrictions': [{
+            'cabin': travel_class,
+            'coverage': 'MOST_SEGMENTS',
+            'originDestinationIds': ['1', '2']
+        }]
+    }
+    if str(non_stop).lower() == 'true':
+        flight_filters['connectionRestriction'] = {'maxNumberOfConnections': 0}
+    # The API accepts either included or excluded carriers, not both
+    if included_carriers:
+        flight_filters['carrierRestrictions'] = {'includedCarrierCodes': list(included_carriers)}
+    elif excluded_carriers:
+        flight_filters['carrierRestrictions'] = {'excludedCarrierCodes': list(excluded_carriers)}
+
+    search_criteria = {'maxFlightOffers': max_offers, 'flightFilters': flight_filters}
+    if max_price:
+        search_criteria['maxPrice'] = int(max_price)
+
+    body = {
+        'originDestinations': [
+            {
+                'id': '1',
+                'originLocationCode': origin,
+                'destinationLocationCode': destination,
+                'departureDateTimeRange': _departure_date_time_range(departure_date, departure_time_option)
+            },
+            {
+                'id': '2',
+                'originLocationCode': destination,
+                'destinationLocationCode': origin,
+                'departureDateTimeRange': _departure_date_time_range(return_date, return_time_option)
+            }
+        ],
+        'travelers': [{'id': '1', 'travelerType': 'ADULT'}],
+        'sources': ['GDS'],
+        'searchCriteria': search_criteria
+    }
+
+    def fetch():
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json',
+            'X-HTTP-Method-Override': 'GET'
+        }
+        response = requests.post(f"{api_url}/v2/shopping/flight-offers", headers=headers, json=body, timeout=REQUEST_TIMEOUT_SECONDS)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"Error: {response.status_code} - {response.text}")
+
+    key = ('POST', api_url, json.dumps(body, sort_keys=True))
+    return _single_flight(key, fetch)
+
+
+# Function to get every date in the travel period falling on the departure weekday
+def get_departure_dates(start_date, end_date, departure_weekday):
+    departure_dates = []
+    current_date = start_date
+    while current_date <= end_date:
+        if current_date.weekday() == departure_weekday:
+            departure_dates.append(current_date)
+        current_date += timedelta(days=1)
+    return departure_dates
+
+
+# Function to get rough round-trip prices over a whole period from the Amadeus
+# flight-dates (cheapest date) search, a single cached calendar query
+def get_flight_dates(access_token, origin, destination, start_date, end_date, number_of_nights, non_stop, api_url):
+    params = {
+        'origin': origin,
+        'destination': destination,
+        'departureDate': f"{start_date},{end_date}",
+        'oneWay': 'false',
+        'duration': number_of_nights,
+        'nonStop': non_stop,
+        'viewBy': 'DATE'
+    }
     headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(f"{api_url}/v2/shopping/flight-offers", headers=headers, params=params)
+    response = requests.get(f"{api_url}/v1/shopping/flight-dates", headers=headers, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
 
     if response.status_code == 200:
         return response.json()
@@ -43,6 +220,68 @@ def get_offers(access_token, origin, destination, departure_date, return_date, n
         raise Exception(f"Error: {response.status_code} - {response.text}")
 
 
+# Function to get the destinations served by direct flights from an airport, from the Amadeus
+# airport routes endpoint, as (IATA city code, city name) pairs
+def get_direct_destinations(access_token, origin, api_url):
+    params = {'departureAirportCode': origin}
+    headers = {'Authorization': f'Bearer {access_token}'}
+    response = requests.get(f"{api_url}/v1/airport/direct-destinations", headers=headers, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+
+    if response.status_code == 200:
+        return [
+            (destination['iataCode'], destination.get('name', ''))
+            for destination in response.json().get('data', []) if destination.get('iataCode')
+        ]
+    else:
+        raise Exception(f"Error: {response.status_code} - {response.text}")
+
+
+# Function to keep the top_k cheapest departure dates according to the flight-dates prices,
+# returns None when the pre-pass has no price for any of the dates
+def select_promising_dates(departure_dates, flight_dates_data, top_k):
+    rough_prices = {}
+    for flight_date in flight_dates_data.get('data', []):
+        try:
+            departure_date = datetime.strptime(flight_date['departureDate'], '%Y-%m-%d').date()
+            price = float(flight_date['price']['total'])
+        except (KeyError, ValueError):
+            continue
+        rough_prices[departure_date] = min(price, rough_prices.get(departure_date, price))
+
+    if not any(departure_date in rough_prices for departure_date in departure_dates):
+        return None
+
+    # Priced dates first from cheapest, then dates the pre-pass has no price for
+    ranked_dates = sorted(departure_dates, key=lambda d: (d not in rough_prices, rough_prices.get(d, 0.0), d))
+    return sorted(ranked_dates[:top_k])
+
+
+ISO_DURATION_PATTERN = re.compile(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?')
+
+
+# Function to convert an ISO-8601 duration such as PT2H15M into minutes
+def parse_iso_duration(duration):
+    match = ISO_DURATION_PATTERN.fullmatch(duration or '')
+    if not match:
+        return 0
+    days, hours, minutes = (int(part) if part else 0 for part in match.groups())
+    return days * 24 * 60 + hours * 60 + minutes
+
+
+# Function to get the travel time, number of stops and total layover time of an itinerary in minutes
+def summarize_itinerary(itinerary):
+    segments = itinerary['segments']
+    layover_minutes = 0
+    for arriving, departing in zip(segments, segments[1:]):
+        # Both times are local to the connecting airport
+        layover_minutes += int((departing['departure']['at'] - arriving['arrival']['at']).total_seconds() // 60)
+    return {
+        'duration_minutes': parse_iso_duration(itinerary['total_duration']),
+        'stops': len(segments) - 1,
+        'layover_minutes': layover_minutes
+    }
+
+
 # Function to parse offers data into a more readable format
 def parse_offers(offers_data):
     parsed_offers = []
@@ -72,11 +311,17 @@ def parse_offers(offers_data):
                     },
                     'carrierCode': segment['carrierCode'],
                     'number': segment['number'],
-                    'duration': segment['duration']
+                    'duration': segment['duration'],
+                    'duration_minutes': parse_iso_duration(segment['duration'])
                 })
-            
+
+            # Travel time and stops as integers, so offers can be ranked without re-parsing
+            parsed_itinerary.update(summarize_itinerary(parsed_itinerary))
             parsed_offer['itineraries'].append(parsed_itinerary)
-        
+
+        parsed_offer['total_duration_minutes'] = sum(itinerary['duration_minutes'] for itinerary in parsed_offer['itineraries'])
+        parsed_offer['total_stops'] = sum(itinerary['stops'] for itinerary in parsed_offer['itineraries'])
+        parsed_offer['layover_minutes'] = sum(itinerary['layover_minutes'] for itinerary in parsed_offer['itineraries'])
         parsed_offers.append(parsed_offer)
     
     return parsed_offers
@@ -124,6 +369,27 @@ def get_cheapest_offer(offers):
         return None
     return min(offers, key=lambda x: float(x['price']))
 
+
+# Function to score a batch of offers, or rows of the results table, on price, travel time and stops
+# in one pass and return them best value first. The score is in the offers' currency:
+#   price_weight * price + duration_weight_per_hour * travel hours + stop_penalty * stops
+def rank_offers(offers, price_weight=1.0, duration_weight_per_hour=0.0, stop_penalty=0.0):
+    for offer in offers:
+        if 'total_duration_minutes' not in offer:
+            # Stored before travel times were precomputed: summarize the itineraries once
+            itineraries = offer.get('itineraries') or [offer['outbound_itinerary'], offer['return_itinerary']]
+            summaries = [summarize_itinerary(itinerary) for itinerary in itineraries]
+            offer['total_duration_minutes'] = sum(summary['duration_minutes'] for summary in summaries)
+            offer['total_stops'] = sum(summary['stops'] for summary in summaries)
+            offer['layover_minutes'] = sum(summary['layover_minutes'] for summary in summaries)
+        offer['value_score'] = round(
+            price_weight * float(offer['price'])
+            + duration_weight_per_hour * offer['total_duration_minutes'] / 60
+            + stop_penalty * offer['total_stops'],
+            2
+        )
+    return sorted(offers, key=lambda offer: offer['value_score'])
+
 def format_flight_details(itinerary, is_outbound):
     journey_type = "Outbound Journey" if is_outbound else "Return Journey"
     first_segment = itinerary['segments'][0]
@@ -143,16 +409,21 @@ def format_flight_details(itinerary, is_outbound):
     details.append(" → ".join(flight_info))
     
     # Convert total travel time to a more readable format
-    total_duration = itinerary['total_duration']
-    hours = re.search(r'(\d+)H', total_duration)
-    minutes = re.search(r'(\d+)M', total_duration)
-    
+    duration_minutes = itinerary.get('duration_minutes')
+    if duration_minutes is None:
+        duration_minutes = parse_iso_duration(itinerary['total_duration'])  # Stored before it was precomputed
+    hours, minutes = divmod(duration_minutes, 60)
+
     formatted_duration = ""
     if hours:
-        formatted_duration += f"{hours.group(1)}H"
+        formatted_duration += f"{hours}H"
     if minutes:
-        formatted_duration += f"{minutes.group(1)}M"
-    
+        formatted_duration += f"{minutes}M"
+
     details.append(f"Total travel time: {formatted_duration}")
+
+    stops = len(itinerary['segments']) - 1
+    if stops:
+        details.append(f"{stops} stop{'s' if stops > 1 else ''}")
     
     return "<br>".join(details)
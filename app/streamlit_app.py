@@ -8,11 +8,17 @@ import hmac
 import pandas as pd
 import psycopg2
 import logging
+import uuid
 
-from search_offers import get_access_token, get_offers, parse_offers, filter_offers_by_time, get_cheapest_offer, format_flight_details
+from search_offers import get_access_token, format_flight_details, rank_offers
+from sweep import get_api_settings, load_sweep_settings, run_sweep
 from lookup_airports import search_airport
+from reference_data import load_reference_tables, get_airlines_dict
 from auth import check_password 
-from db_operations import insert_data, create_tables
+from db_operations import insert_data, create_tables, insert_job, get_job, get_flight_prices, get_past_searches
+from airline_logos import cache_logos, get_logo_data_uri
+from result_store import ResultStore
+from route_graph import get_reachable_destinations
 
 from streamlit_extras.buy_me_a_coffee import button
 from streamlit_searchbox import st_searchbox
@@ -31,19 +37,8 @@ load_dotenv()
 # Get environment
 environment = os.getenv('ENVIRONMENT', 'production')
 
-# Set API endpoint based on the environment
-API_URL = "https://test.api.amadeus.com" if environment == "test" else "https://api.amadeus.com"
-
-# Load API credentials
-if environment == "test":
-    api_key = os.getenv('TEST_API_KEY')
-    api_secret = os.getenv('TEST_API_SECRET')
-else:
-    api_key = os.getenv('PROD_API_KEY')
-    api_secret = os.getenv('PROD_API_SECRET')
-
-if not api_key or not api_secret:
-    raise ValueError(f"API credentials not found for {environment} environment.")
+# Set API endpoint and credentials based on the environment
+API_URL, api_key, api_secret = get_api_settings()
 
 # Load default search parameters from parameters.toml
 params_config = toml.load('config/parameters.toml')
@@ -56,14 +51,30 @@ travel_class_default = params_config['search']['travel_class'].upper()
 departure_time_option_default = params_config['search'].get('departure_time_option', 'Any')
 return_time_option_default = params_config['search'].get('return_time_option', 'Any')
 
-# Read the airlines CSV file
-airlines_df = pd.read_csv('data/airlines.csv')
+# Flight offers search and date sweep settings
+sweep_settings = load_sweep_settings(params_config)
+
+# Run sweeps in background workers instead of the script thread
+jobs_config = params_config.get('jobs', {})
+background_jobs = jobs_config.get('background', False)
+job_poll_seconds = jobs_config.get('poll_seconds', 2)
+
+# Number of flight options shown per page on the results page
+results_config = params_config.get('results', {})
+options_page_size = results_config.get('options_page_size', 10)
+
+# Weights of the best value ranking: price against travel time and stops
+ranking_settings = sweep_settings['ranking']
+
+# Number of past searches shown per page of the search history
+history_page_size = params_config.get('history', {}).get('page_size', 10)
+
+# Create a dictionary for quick lookup of both name and URL from the airline reference data
+@st.cache_resource
+def load_airlines_dict():
+    return get_airlines_dict(load_reference_tables()['airlines'])
 
-# Create a dictionary for quick lookup of both name and URL
-airlines_dict = {
-    iata: {'name': name, 'url': url} 
-    for iata, name, url in zip(airlines_df['IATA'], airlines_df['Name'], airlines_df['url'])
-}
+airlines_dict = load_airlines_dict()
 
 
 #  Styling
@@ -217,6 +228,179 @@ st.markdown(
 #if not check_password():
 #    st.stop()
 
+# Build the HTML of every flight option row, sorted by price
+def build_flight_options_html(df):
+    rows = []
+    logo_uris = {}  # Read each carrier's logo from the cache only once
+    for _, row in df.iterrows():
+        # Get the airline code from the first segment of the outbound itinerary
+        airline_code = row['outbound_itinerary']['segments'][0]['carrierCode']
+        if airline_code not in logo_uris:
+            logo_uris[airline_code] = get_logo_data_uri(airline_code)  # Embedded from the local logo cache
+        logo_url = logo_uris[airline_code]
+        airline_info = airlines_dict.get(airline_code, {'name': 'Unknown Airline', 'url': '#'})
+        airline_name = airline_info['name']
+        airline_url = airline_info['url']
+
+        price_parts = row['Price'].split()
+        price_value = price_parts[0].split('.')[0]  # Get the integer part before the decimal point
+        currency = price_parts[1] if len(price_parts) > 1 else ''  # Get the currency if it exists
+
+        rows.append({
+            'airline': f"""
+                <div style="display: flex; flex-direction: column; justify-content: center; align-items: center; height: 100%;">
+                    <img src="{logo_url}" style="max-width: 100%; max-height: 50px; margin-bottom: 5px;">
+                    <p style="font-size: 0.8em; text-align: center; margin: 0;">
+                        <a href="{airline_url}" target="_blank" style="text-decoration: none; color: inherit;">
+                            {airline_name}
+                        </a>
+                    </p>
+                </div>
+            """,
+            'outbound': format_flight_details(row['outbound_itinerary'], is_outbound=True),
+            'return': format_flight_details(row['return_itinerary'], is_outbound=False),
+            'price': f"""
+                <div style="display: flex; justify-content: center; align-items: center; height: 100%;">
+                    <p style="font-size: 1.2em; font-weight: bold; margin: 0;">
+                        <a href="{airline_url}" target="_blank" style="text-decoration: none; color: #FFA500;">
+                            {price_value} {currency}
+                        </a>
+                    </p>
+                </div>
+            """
+        })
+    return rows
+
+# Destinations known to be served by direct flights from an origin, for the destination picker
+@st.cache_data(ttl=600)
+def load_reachable_destinations(origin):
+    try:
+        return get_reachable_destinations(origin, sweep_settings)
+    except Exception as e:
+        print(f"Error loading direct destinations of {origin}: {e}", file=sys.stderr)
+        return []
+
+# Search results shared by all sessions of this process, within a per-session and a global memory cap
+@st.cache_resource
+def get_result_store():
+    return ResultStore(
+        max_bytes_per_session=int(results_config.get('session_cache_mb', 5) * 1024 * 1024),
+        max_bytes_total=int(results_config.get('global_cache_mb', 200) * 1024 * 1024)
+    )
+
+# Function to rebuild evicted results from the database
+def rebuild_flight_prices(search_inputs_id):
+    if search_inputs_id is None:
+        return None  # Results that were never recorded cannot be rebuilt
+    try:
+        return get_flight_prices(search_inputs_id)
+    except Exception as e:
+        print(f"Error rebuilding results of search {search_inputs_id}: {e}", file=sys.stderr)
+        return None
+
+# Show the results collected so far while a sweep is running
+def show_partial_results(placeholder, flight_prices):
+    if flight_prices:
+        partial_df = pd.DataFrame(flight_prices).sort_values('departure_date')
+        partial_df = partial_df[['departure_date', 'price', 'currency', 'departure_flight', 'return_flight']]
+        partial_df.columns = ['Departure Date', 'Price', 'Currency', 'Departure Flight(s)', 'Return Flight(s)']
+        placeholder.dataframe(partial_df, hide_index=True)
+
+# Store the results of a finished sweep and switch to the results page
+def show_results(flight_prices, search_inputs_id):
+    # Results are kept in the shared result store, the session only keeps their key
+    result_key = f"flight_prices:{search_inputs_id or uuid.uuid4()}"
+    get_result_store().put(st.session_state['session_id'], result_key, flight_prices)
+    st.session_state['result_key'] = result_key
+    st.session_state['search_inputs_id'] = search_inputs_id
+    st.session_state['flight_options_shown'] = options_page_size
+
+    # Make sure the carriers' logos are in the local cache before rendering
+    cache_logos(row['outbound_itinerary']['segments'][0]['carrierCode'] for row in flight_prices)
+
+    st.session_state['page'] = 'results'
+    st.rerun()  # Redirect to results page if available
+
+# Function to prepare the stored inputs of a past search for a re-run
+def get_rerun_search_inputs(stored_inputs):
+    search_inputs = {key: value for key, value in stored_inputs.items() if key != 'user'}
+    search_inputs['environment'] = environment
+    # Travel periods that already started resume from tomorrow; periods that are already over
+    # move forward to start tomorrow, keeping their length
+    tomorrow = (datetime.now() + timedelta(days=1)).date()
+    start_date = datetime.strptime(search_inputs['start_date'], '%Y-%m-%d').date()
+    end_date = datetime.strptime(search_inputs['end_date'], '%Y-%m-%d').date()
+    if end_date < tomorrow:
+        search_inputs['end_date'] = str(tomorrow + (end_date - start_date))
+    if start_date < tomorrow:
+        search_inputs['start_date'] = str(tomorrow)
+    return search_inputs
+
+# Show a page of past searches with filters, keyset pagination and one-click re-runs
+def show_search_history():
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        history_origin = st.text_input("Origin code", key="history_origin", placeholder="ZRH").strip().upper()
+    with col2:
+        history_destination = st.text_input("Destination code", key="history_destination", placeholder="OPO").strip().upper()
+    with col3:
+        history_dates = st.date_input("Searched between", value=(), key="history_dates")
+    history_mine = st.checkbox("Only my searches", key="history_mine", disabled=not st.session_state.get('user'))
+
+    # Restart from the newest page whenever the filters change
+    history_filters = (history_origin, history_destination, tuple(history_dates), history_mine)
+    if st.session_state.get('history_filters') != history_filters:
+        st.session_state['history_filters'] = history_filters
+        st.session_state['history_cursors'] = [None]
+    cursors = st.session_state['history_cursors']
+
+    created_from = created_to = None
+    if len(history_dates) == 2:
+        created_from = history_dates[0]
+        created_to = history_dates[1] + timedelta(days=1)
+
+    try:
+        searches, next_cursor = get_past_searches(
+            limit=history_page_size,
+            user=st.session_state.get('user') if history_mine else None,
+            origin=history_origin or None,
+            destination=history_destination or None,
+            created_from=created_from,
+            created_to=created_to,
+            before=cursors[-1]
+        )
+    except Exception as e:
+        print(f"Error loading search history: {e}", file=sys.stderr)
+        st.caption("Search history is not available.")
+        return
+
+    if not searches:
+        st.caption("No past searches found.")
+    for search_id, stored_inputs, created_at in searches:
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.markdown(
+                f"**{stored_inputs.get('origin')} → {stored_inputs.get('destination')}**, "
+                f"{stored_inputs.get('departure_day')}s, {stored_inputs.get('number_of_nights')} nights, "
+                f"{stored_inputs.get('start_date')} to {stored_inputs.get('end_date')}, "
+                f"{stored_inputs.get('flight_type')}, {stored_inputs.get('travel_class')}  \n"
+                f"Searched {created_at.strftime('%d.%m.%Y %H:%M')}"
+            )
+        with col2:
+            if st.button("Re-run", key=f"rerun_search_{search_id}"):
+                st.session_state['rerun_search_inputs'] = stored_inputs
+                st.rerun()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("Newer searches", key="history_newer"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if next_cursor and st.button("Older searches", key="history_older"):
+            cursors.append(next_cursor)
+            st.rerun()
+
 # Modify search_airport to use the loaded airport_data
 def search_airport_wrapper(query: str):
     return search_airport(query)  
@@ -224,6 +408,10 @@ def search_airport_wrapper(query: str):
 if 'page' not in st.session_state:
     st.session_state['page'] = 'input'
 
+# Identifies the session's entries in the shared result store
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = str(uuid.uuid4())
+
 if st.session_state['page'] == 'input':
     # Create a container for the top section
     top_container = st.container()
@@ -277,6 +465,11 @@ if st.session_state['page'] == 'input':
             )
             if destination_full:
                 destination = destination_full.split('(')[1].split(')')[0] if destination_full else ''
+
+        if origin_full:
+            reachable_destinations = load_reachable_destinations(origin)
+            if reachable_destinations:
+                st.caption(f"Direct flights from {origin} known to: {', '.join(reachable_destinations)}")
         
             
     # Flight Details Expander
@@ -319,163 +512,70 @@ if st.session_state['page'] == 'input':
         with col2:
             travel_class = st.selectbox("Select travel class", ["ECONOMY", "PREMIUM_ECONOMY", "BUSINESS", "FIRST"], index=["ECONOMY", "PREMIUM_ECONOMY", "BUSINESS", "FIRST"].index(travel_class_default))
 
-    # Results retrieval
-    if st.button("Search Flights"):
+    # Results retrieval, for the inputs above or a past search re-run from the history
+    rerun_search_inputs = st.session_state.pop('rerun_search_inputs', None)
+    if st.button("Search Flights") or rerun_search_inputs:
         try:
             # Ensure tables exist
             create_tables()
 
             # Store search parameters in session state
-            search_inputs = {
-                'origin': origin,
-                'destination': destination,
-                'departure_day': departure_day,
-                'number_of_nights': number_of_nights,
-                'start_date': str(start_date),
-                'end_date': str(end_date),
-                'flight_type': flight_type,
-                'travel_class': travel_class,
-                'departure_time_option': departure_time_option,
-                'return_time_option': return_time_option,
-                'environment': environment  # Add environment to search inputs
-            }
+            if rerun_search_inputs:
+                search_inputs = get_rerun_search_inputs(rerun_search_inputs)
+                if (search_inputs['start_date'], search_inputs['end_date']) != (rerun_search_inputs['start_date'], rerun_search_inputs['end_date']):
+                    st.info(f"Part of the original travel period is in the past, searching from {search_inputs['start_date']} "
+                            f"to {search_inputs['end_date']} instead.")
+            else:
+                search_inputs = {
+                    'origin': origin,
+                    'destination': destination,
+                    'departure_day': departure_day,
+                    'number_of_nights': number_of_nights,
+                    'start_date': str(start_date),
+                    'end_date': str(end_date),
+                    'flight_type': flight_type,
+                    'travel_class': travel_class,
+                    'departure_time_option': departure_time_option,
+                    'return_time_option': return_time_option,
+                    'environment': environment  # Add environment to search inputs
+                }
+            search_inputs['user'] = st.session_state.get('user')
             st.session_state['search_inputs'] = search_inputs
 
             # Record search inputs
-            if search_inputs:
-                search_inputs_id = insert_data(search_inputs, 'search_inputs')
+            search_inputs_id = insert_data(search_inputs, 'search_inputs')
+
+            if background_jobs:
+                # Hand the sweep over to the background workers and follow its progress
+                job_id = insert_job(search_inputs, search_inputs_id)
+                if job_id is None:
+                    raise Exception("The search could not be queued.")
+                st.session_state['job_id'] = job_id
+                st.session_state['page'] = 'job'
+                st.rerun()
 
             # Get access token
             access_token = get_access_token(api_key, api_secret, API_URL)
 
-            # Convert flight_type to boolean for the API call
-            direct_flight = (str(flight_type == "Direct").lower())  
-
-            # Map departure day to weekday number
-            day_mapping = {
-                'Monday': 0, 'Tuesday': 1, 'Wednesday': 2, 'Thursday': 3,
-                'Friday': 4, 'Saturday': 5, 'Sunday': 6
-            }
-            departure_day_num = day_mapping[departure_day]
-
-            # Map time of departure and return to numbers
-            time_mapping = {
-                "Any": 0,
-                "Morning (midnight to noon)": 1,
-                "Afternoon and evening (noon to midnight)": 2,
-                "Evening (6pm to midnight)": 3
-            }
-
-            # Map departure and return time options to numbers
-            departure_time_option_num = time_mapping[departure_time_option]
-            return_time_option_num = time_mapping[return_time_option]
-        
-            current_date = start_date # Initialize current date
-            flight_prices = []  # Collect data for table and plotting
-
-            # Initialize progress bar
-            total_days = (end_date - start_date).days + 1
+            # Initialize progress bar, notices and the table of results coming in
             progress_bar = st.progress(0)
-            progress_counter = 0
-
-
-            while current_date <= end_date:
-                if current_date.weekday() == departure_day_num:
-                    departure_date_str = current_date.strftime('%Y-%m-%d')
-                    return_date = current_date + timedelta(days=number_of_nights)
-                    return_date_str = return_date.strftime('%Y-%m-%d')
-
-                    try:
-                        # Fetch offers
-                        try:
-                            offers_data = get_offers(
-                                access_token, origin, destination,
-                                departure_date_str, return_date_str,
-                                direct_flight, travel_class, API_URL
-                            )
-                        except Exception as e:
-                            print(f"Error in get_offers: {str(e)}", file=sys.stderr)
-                            logging.error(f"Error fetching offers: {str(e)}")
-                            st.error(f"An error occurred while fetching flight data: {str(e)}")
-                            st.stop()  # Stop execution completely instead of continue
-
-                        if not offers_data:
-                            print("No offers data returned", file=sys.stderr)
-                            #st.stop()  # Stop execution completely instead of continue
-
-                        # Only proceed if we have offers data
-                        if offers_data:
-                            # Parse offers data
-                            parsed_offers = parse_offers(offers_data)
-
-                            # Record parsed offers in database
-                            if parsed_offers:
-                                parsed_offers_id = insert_data(parsed_offers, 'parsed_offers', search_inputs_id)
-
-                            # Filter offers based on preferred departure and return times
-                            filtered_offers = filter_offers_by_time(parsed_offers, departure_time_option_num, return_time_option_num)
-
-                            # Get the cheapest offer
-                            cheapest_offer = get_cheapest_offer(filtered_offers)
-
-                            if cheapest_offer:
-                                # Extract departure flight details
-                                departure_segments = cheapest_offer['itineraries'][0]['segments']
-                                departure_flights = ", ".join([f"{seg['carrierCode']} {seg['number']}" for seg in departure_segments])
-                                departure_time = departure_segments[0]['departure']['at']
-
-                                # Extract return flight details
-                                return_segments = cheapest_offer['itineraries'][1]['segments']
-                                return_flights = ", ".join([f"{seg['carrierCode']} {seg['number']}" for seg in return_segments])
-                                return_time = return_segments[0]['departure']['at']
-
-                                # Store data for the table
-                                flight_prices.append({
-                                    "departure_date": departure_date_str,
-                                    "departure_time": departure_time.strftime('%H:%M'),
-                                    "departure_flight": departure_flights,
-                                    "return_date": return_date_str,
-                                    "return_time": return_time.strftime('%H:%M'),
-                                    "return_flight": return_flights,
-                                    "price": round(cheapest_offer['price'], 2),
-                                    "currency": cheapest_offer['currency'],
-                                    "origin": origin,
-                                    "destination": destination,
-                                    "outbound_itinerary": cheapest_offer['itineraries'][0],
-                                    "return_itinerary": cheapest_offer['itineraries'][1]
-                                })
-
-                    except Exception as e:
-                        if '429' in str(e):
-                            st.markdown('<div class="naked-text"><p>Rate limit reached. Waiting for 60 seconds...</p></div>', unsafe_allow_html=True)
-                            time.sleep(60)
-                        else:
-                            print(f"Outer exception: {str(e)}", file=sys.stderr)  # Debug line
-                            st.error(f"An error occurred while fetching flight data: {str(e)}")
-                            continue  # Skip to next date instead of breaking
-
-                    # Pause to respect rate limit
-                    if environment == "test":
-                        time.sleep(0.5)
-                    else:
-                        time.sleep(0.05)
-
-                # Update progress
-                progress_counter += 1
-                progress_bar.progress(min(progress_counter / total_days, 1.0))
-
-                current_date += timedelta(days=1)
+            sweep_notices = st.container()
+            partial_results = st.empty()
+
+            try:
+                flight_prices = run_sweep(
+                    search_inputs, search_inputs_id, access_token, API_URL, sweep_settings,
+                    on_progress=lambda done, total: progress_bar.progress(done / total if total else 1.0),
+                    on_result=lambda results: show_partial_results(partial_results, results),
+                    on_notice=lambda message: sweep_notices.markdown(f'<div class="naked-text"><p>{message}</p></div>', unsafe_allow_html=True)
+                )
+            except Exception as e:
+                st.error(f"An error occurred while fetching flight data: {str(e)}")
+                st.stop()  # Stop execution completely instead of continue
 
             # Store flight data in session state for the results page
             if flight_prices:
-                st.session_state['flight_prices'] = pd.DataFrame(flight_prices)
-
-                # Record flight prices in database
-                if search_inputs_id:
-                    flight_prices_id = insert_data(flight_prices, 'flight_prices', search_inputs_id)
-
-                st.session_state['page'] = 'results'
-                st.rerun()  # Redirect to results page if available
+                show_results(flight_prices, search_inputs_id)
             else:
                 st.markdown('<div class="naked-text"><p>No flight data available for the selected date range.</p></div>', unsafe_allow_html=True)
 
@@ -483,18 +583,77 @@ if st.session_state['page'] == 'input':
             st.error(f"An error occurred: {e}")
             print(f"Error details: {e}", file=sys.stderr)
 
+    # Search History Expander
+    with st.expander("**Search History**", expanded=False):
+        show_search_history()
+
     # Add space before the button
     st.write("")
     col1, col2, col3 = st.columns(3)
     with col3:
         button(username="flymeaway", floating=False, width=221)
     
+# Background search page
+elif st.session_state['page'] == 'job' and 'job_id' in st.session_state:
+    st.markdown('<h1 class="output-text">Searching Flights</h1>', unsafe_allow_html=True)
+
+    job = get_job(st.session_state['job_id'])
+    if job is None:
+        st.error("The search could not be found.")
+    elif job['status'] == 'done':
+        if job['result']:
+            show_results(job['result'], job['search_inputs_id'])
+        else:
+            st.markdown('<div class="naked-text"><p>No flight data available for the selected date range.</p></div>', unsafe_allow_html=True)
+    elif job['status'] == 'failed':
+        st.error(f"An error occurred while fetching flight data: {job['error']}")
+    else:
+        if job['status'] == 'queued':
+            st.markdown('<div class="naked-text"><p>Waiting for a search worker...</p></div>', unsafe_allow_html=True)
+        st.progress(job['progress'] / job['total'] if job['total'] else 0.0)
+        if job['notice']:
+            st.markdown(f'<div class="naked-text"><p>{job["notice"]}</p></div>', unsafe_allow_html=True)
+        show_partial_results(st.empty(), job['result'])
+
+    if st.button("Back to Search"):
+        st.session_state['page'] = 'input'
+        st.rerun()
+
+    # Poll the job until it has finished
+    if job is not None and job['status'] in ('queued', 'running'):
+        time.sleep(job_poll_seconds)
+        st.rerun()
+
 # Results Page
-elif st.session_state['page'] == 'results' and 'flight_prices' in st.session_state:
+elif st.session_state['page'] == 'results' and 'result_key' in st.session_state:
     st.markdown('<h1 class="output-text">Flight Price Details</h1>', unsafe_allow_html=True)
-    
-    # Create a fresh copy of the DataFrame
-    df = st.session_state['flight_prices'].copy()
+
+    # Fetch the results from the shared store, rebuilding them from the database if they were evicted
+    result_key = st.session_state['result_key']
+    search_inputs_id = st.session_state.get('search_inputs_id')
+    flight_prices = get_result_store().get(
+        result_key, st.session_state['session_id'],
+        rebuild=lambda: rebuild_flight_prices(search_inputs_id)
+    )
+    if not flight_prices:
+        st.markdown('<div class="naked-text"><p>These results are no longer available, please search again.</p></div>', unsafe_allow_html=True)
+        if st.button("Back to Search"):
+            st.session_state['page'] = 'input'
+            st.rerun()
+        st.stop()
+
+    # Each date's cheapest offer, followed by its best value offer when that is a different one
+    offer_rows = []
+    for flight_price in flight_prices:
+        offer_rows.append({**flight_price, 'best_value': None, 'is_cheapest_of_date': True})
+        if flight_price.get('best_value'):
+            offer_rows.append({**flight_price['best_value'], 'best_value': None, 'is_cheapest_of_date': False})
+
+    # Score the offers of all dates on price, travel time and stops in one batch
+    rank_offers(offer_rows, **ranking_settings)
+
+    # Build the DataFrame fresh from the stored results
+    df = pd.DataFrame(offer_rows)
     
     # New expander for input parameters
     with st.expander("**Search Parameters**", expanded=False):
@@ -521,91 +680,77 @@ elif st.session_state['page'] == 'results' and 'flight_prices' in st.session_sta
     df['Price'] = df.apply(lambda row: f"{row['price']:.2f} {row['currency']}", axis=1)
     
     # Reorder columns to have Price first, then remove individual price and currency columns
-    columns_order = ['Price', 'departure_date', 'departure_time', 'departure_flight', 'return_date', 'return_time', 'return_flight', 'price', 'currency', 'origin', 'destination', 'outbound_itinerary', 'return_itinerary']
+    columns_order = ['Price', 'departure_date', 'departure_time', 'departure_flight', 'return_date', 'return_time', 'return_flight', 'price', 'currency', 'origin', 'destination', 'outbound_itinerary', 'return_itinerary', 'total_duration_minutes', 'total_stops', 'value_score', 'is_cheapest_of_date']
     df = df[columns_order]
+
+    # Travel time of both journeys in hours and minutes
+    df['Travel Time'] = df['total_duration_minutes'].apply(lambda minutes: f"{minutes // 60}H{minutes % 60:02d}M")
     
     # Highlight the best price in the results table
-    best_price_index = df['Price'].apply(lambda x: float(x.split()[0])).idxmin()
+    best_price_index = df['price'].idxmin()
     df.insert(0, '🔥', ['🔥' if i == best_price_index else '' for i in df.index])
 
+    # Mark the best value when it is not also the cheapest
+    best_value_index = df['value_score'].idxmin()
+    df.insert(1, '⭐', ['⭐' if i == best_value_index and i != best_price_index else '' for i in df.index])
+
     def highlight_best_price(row):
         return ['background-color: lightgreen' if row.name == best_price_index else '' for _ in row]
 
     # Price Trend Chart Expander
     with st.expander("**Price Trends**", expanded=True):
-        # Create a copy of the DataFrame
-        df_chart = df.copy()
-        # Extract numeric price for charting
-        df_chart.loc[:, 'numeric_price'] = df_chart['Price'].apply(lambda x: float(x.split()[0]))
-        df_chart = df_chart.set_index('departure_date')['numeric_price']
+        # Chart the numeric price per departure date, from the cheapest offer of each date
+        df_chart = df[df['is_cheapest_of_date']].set_index('departure_date')['price']
         st.scatter_chart(df_chart)
     
     # Detailed Flight Information Expander
     with st.expander("**Summary**", expanded=True):
         # Select only the columns you want to display
-        columns_to_display = ['🔥', 'Price', 'departure_date', 'departure_time', 'departure_flight', 'return_date', 'return_time', 'return_flight']
-        df_display = df[columns_to_display].copy()
+        columns_to_display = ['🔥', '⭐', 'Price', 'departure_date', 'departure_time', 'departure_flight', 'return_date', 'return_time', 'return_flight', 'Travel Time', 'total_stops']
+        df_display = df[columns_to_display]
 
         # Rename columns if needed
-        df_display.columns = ['Best Deal', 'Price', 'Departure Date', 'Departure Time', 'Departure Flight(s)', 'Return Date', 'Return Time', 'Return Flight(s)']
+        df_display = df_display.set_axis(['Best Deal', 'Best Value', 'Price', 'Departure Date', 'Departure Time', 'Departure Flight(s)', 'Return Date', 'Return Time', 'Return Flight(s)', 'Travel Time', 'Stops'], axis=1)
 
         styled_df = df_display.style.apply(highlight_best_price, axis=1)
         st.dataframe(styled_df)
 
-    # Sort the DataFrame by price before displaying
-    df['numeric_price'] = df['Price'].apply(lambda x: float(x.split()[0]))  # Create a numeric price column
-    df = df.sort_values('numeric_price')  # Sort by the numeric price
-
     with st.expander("**Flight Options**", expanded=True):
-        total_rows = len(df)
-        for index, (_, row) in enumerate(df.iterrows(), start=1):
+        sort_by = st.radio("Sort by", ["Price", "Best value"], horizontal=True, key="flight_options_sort")
+
+        # Sort the DataFrame by price, or by the precomputed value score, before displaying
+        df = df.sort_values('price' if sort_by == "Price" else 'value_score')
+
+        # Pre-render the flight option rows once per result set and order, kept alongside the results in the store
+        flight_options_html = get_result_store().get(
+            f"flight_options:{sort_by}:{result_key}", st.session_state['session_id'],
+            rebuild=lambda: build_flight_options_html(df)
+        )
+
+        total_rows = len(flight_options_html)
+        shown_rows = min(st.session_state['flight_options_shown'], total_rows)
+        for index, option_html in enumerate(flight_options_html[:shown_rows], start=1):
             col1, col2, col3, col4 = st.columns([1, 2, 2, 1])
-            
             with col1:
-                # Get the airline code from the first segment of the outbound itinerary
-                airline_code = row['outbound_itinerary']['segments'][0]['carrierCode']
-                logo_url = f"https://airlabs.co/img/airline/m/{airline_code}.png"
-                airline_info = airlines_dict.get(airline_code, {'name': 'Unknown Airline', 'url': '#'})
-                airline_name = airline_info['name']
-                airline_url = airline_info['url']
-                st.markdown(f"""
-                    <div style="display: flex; flex-direction: column; justify-content: center; align-items: center; height: 100%;">
-                        <img src="{logo_url}" style="max-width: 100%; max-height: 50px; margin-bottom: 5px;">
-                        <p style="font-size: 0.8em; text-align: center; margin: 0;">
-                            <a href="{airline_url}" target="_blank" style="text-decoration: none; color: inherit;">
-                                {airline_name}
-                            </a>
-                        </p>
-                    </div>
-                """, unsafe_allow_html=True)
-            
+                st.markdown(option_html['airline'], unsafe_allow_html=True)
             with col2:
-                outbound_details = format_flight_details(row['outbound_itinerary'], is_outbound=True)
-                st.markdown(outbound_details, unsafe_allow_html=True)
-                
+                st.markdown(option_html['outbound'], unsafe_allow_html=True)
             with col3:
-                return_details = format_flight_details(row['return_itinerary'], is_outbound=False)
-                st.markdown(return_details, unsafe_allow_html=True)
-            
+                st.markdown(option_html['return'], unsafe_allow_html=True)
             with col4:
-                price_parts = row['Price'].split()
-                price_value = price_parts[0].split('.')[0]  # Get the integer part before the decimal point
-                currency = price_parts[1] if len(price_parts) > 1 else ''  # Get the currency if it exists
-                
-                st.markdown(f"""
-                    <div style="display: flex; justify-content: center; align-items: center; height: 100%;">
-                        <p style="font-size: 1.2em; font-weight: bold; margin: 0;">
-                            <a href="{airline_url}" target="_blank" style="text-decoration: none; color: #FFA500;">
-                                {price_value} {currency}
-                            </a>
-                        </p>
-                    </div>
-                """, unsafe_allow_html=True)
-            
+                st.markdown(option_html['price'], unsafe_allow_html=True)
+
             # Only add separator if it's not the last row
-            if index < total_rows:
+            if index < shown_rows:
                 st.markdown("---")  # Separator between flight options
 
+        # Load further options on demand
+        if shown_rows < total_rows:
+            st.caption(f"Showing {shown_rows} of {total_rows} flight options")
+            if st.button("Show more options"):
+                st.session_state['flight_options_shown'] += options_page_size
+                st.rerun()
+
     if st.button("Back to Search"):
         st.session_state['page'] = 'input'
         st.rerun()
@@ -0,0 +1,338 @@
+import os
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+import toml
+from dotenv import load_dotenv
+
+from search_offers import get_offers, get_offers_post, parse_offers, filter_offers_by_time, get_cheapest_offer, rank_offers
+from search_offers import get_departure_dates, get_flight_dates, select_promising_dates, get_coalescing_stats
+from db_operations import insert_data, get_sweep_key, get_checkpoints, insert_checkpoint
+from route_graph import record_observed_routes, check_direct_route
+from offer_store import load_storage_settings, record_parsed_offers
+
+# The date sweep of a search, independent of Streamlit so that it can run both
+# in the app's script thread and in background sweep workers
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Get environment
+environment = os.getenv('ENVIRONMENT', 'production')
+
+# Map departure day to weekday number
+DAY_MAPPING = {
+    'Monday': 0, 'Tuesday': 1, 'Wednesday': 2, 'Thursday': 3,
+    'Friday': 4, 'Saturday': 5, 'Sunday': 6
+}
+
+# Map time of departure and return to numbers
+TIME_MAPPING = {
+    "Any": 0,
+    "Morning (midnight to noon)": 1,
+    "Afternoon and evening (noon to midnight)": 2,
+    "Evening (6pm to midnight)": 3
+}
+
+# Retries of a date after the API rate limit is hit, waiting a minute each time
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_WAIT_SECONDS = 60
+
+
+# Function to get the API endpoint and credentials of the current environment
+def get_api_settings():
+    # Set API endpoint based on the environment
+    api_url = "https://test.api.amadeus.com" if environment == "test" else "https://api.amadeus.com"
+
+    # Load API credentials
+    if environment == "test":
+        api_key = os.getenv('TEST_API_KEY')
+        api_secret = os.getenv('TEST_API_SECRET')
+    else:
+        api_key = os.getenv('PROD_API_KEY')
+        api_secret = os.getenv('PROD_API_SECRET')
+
+    if not api_key or not api_secret:
+        raise ValueError(f"API credentials not found for {environment} environment.")
+    return api_url, api_key, api_secret
+
+
+# Function to load the search and sweep settings from parameters.toml
+def load_sweep_settings(params_config=None):
+    if params_config is None:
+        params_config = toml.load('config/parameters.toml')
+    api_config = params_config.get('api', {})
+    sweep_config = params_config.get('sweep', {})
+    routes_config = params_config.get('routes', {})
+    ranking_config = params_config.get('ranking', {})
+    return {
+        # Flight offers search settings
+        'search_method': api_config.get('search_method', 'GET').upper(),
+        'max_offers': api_config.get('max_offers', 50),
+        'max_price': api_config.get('max_price'),
+        'included_carriers': api_config.get('included_carriers', []),
+        'excluded_carriers': api_config.get('excluded_carriers', []),
+        # Cheapest-date pre-pass settings of the date sweep
+        'prepass': sweep_config.get('prepass', False),
+        'prepass_top_k': sweep_config.get('prepass_top_k', 4),
+        # Completed sweep dates are reused when the same search is re-submitted within this many minutes
+        'checkpoint_ttl_minutes': sweep_config.get('checkpoint_ttl_minutes', 60),
+        # Direct-route check of direct-flight searches: "warn", "reject" or "off"
+        'route_check': routes_config.get('check', 'warn'),
+        'route_ttl_hours': routes_config.get('ttl_hours', 168),
+        'route_endpoint': routes_config.get('use_endpoint', False),
+        # Storage of the parsed offers of each date: "jsonb" or "dedup"
+        **load_storage_settings(params_config),
+        # Weights of the best value ranking: price against travel time and stops
+        'ranking': {
+            'price_weight': ranking_config.get('price_weight', 1.0),
+            'duration_weight_per_hour': ranking_config.get('duration_weight_per_hour', 10.0),
+            'stop_penalty': ranking_config.get('stop_penalty', 30.0)
+        }
+    }
+
+
+# Function to fetch the offers of one date of a search with the configured search method
+def fetch_offers(access_token, search_inputs, departure_date_str, return_date_str, api_url, settings):
+    origin = search_inputs['origin']
+    destination = search_inputs['destination']
+    travel_class = search_inputs['travel_class']
+    # Convert flight_type to boolean for the API call
+    direct_flight = str(search_inputs['flight_type'] == "Direct").lower()
+
+    if settings['search_method'] == 'POST':
+        # Let the server filter on time windows, price and carriers
+        return get_offers_post(
+            access_token, origin, destination,
+            departure_date_str, return_date_str,
+            direct_flight, travel_class, api_url,
+            departure_time_option=TIME_MAPPING[search_inputs['departure_time_option']],
+            return_time_option=TIME_MAPPING[search_inputs['return_time_option']],
+            max_offers=settings['max_offers'], max_price=settings['max_price'],
+            included_carriers=settings['included_carriers'],
+            excluded_carriers=settings['excluded_carriers']
+        )
+    return get_offers(
+        access_token, origin, destination,
+        departure_date_str, return_date_str,
+        direct_flight, travel_class, api_url,
+        max_offers=settings['max_offers']
+    )
+
+
+# Function to turn the cheapest offer of a date into a row of the results table
+def build_flight_price(cheapest_offer, departure_date_str, return_date_str, origin, destination):
+    # Extract departure flight details
+    departure_segments = cheapest_offer['itineraries'][0]['segments']
+    departure_flights = ", ".join([f"{seg['carrierCode']} {seg['number']}" for seg in departure_segments])
+    departure_time = departure_segments[0]['departure']['at']
+
+    # Extract return flight details
+    return_segments = cheapest_offer['itineraries'][1]['segments']
+    return_flights = ", ".join([f"{seg['carrierCode']} {seg['number']}" for seg in return_segments])
+    return_time = return_segments[0]['departure']['at']
+
+    return {
+        "departure_date": departure_date_str,
+        "departure_time": departure_time.strftime('%H:%M'),
+        "departure_flight": departure_flights,
+        "return_date": return_date_str,
+        "return_time": return_time.strftime('%H:%M'),
+        "return_flight": return_flights,
+        "price": round(cheapest_offer['price'], 2),
+        "currency": cheapest_offer['currency'],
+        "origin": origin,
+        "destination": destination,
+        "total_duration_minutes": cheapest_offer['total_duration_minutes'],
+        "total_stops": cheapest_offer['total_stops'],
+        "layover_minutes": cheapest_offer['layover_minutes'],
+        "outbound_itinerary": cheapest_offer['itineraries'][0],
+        "return_itinerary": cheapest_offer['itineraries'][1]
+    }
+
+
+# Function to parse and record the offers of one date and return its cheapest offer matching
+# the search's time preferences as a row of the results table, or None. All matching offers
+# are ranked on value, and the best value offer is kept under 'best_value' when it is not
+# the cheapest one.
+def process_offers(offers_data, search_inputs, search_inputs_id, departure_date_str, return_date_str, settings=None):
+    if not offers_data:
+        print("No offers data returned", file=sys.stderr)
+        return None
+
+    # Parse offers data
+    parsed_offers = parse_offers(offers_data)
+
+    # Record parsed offers in database
+    if parsed_offers:
+        record_parsed_offers(parsed_offers, search_inputs_id, settings or {}, offers_data)
+        record_observed_routes(parsed_offers)
+
+    # Filter offers based on preferred departure and return times
+    filtered_offers = filter_offers_by_time(
+        parsed_offers,
+        TIME_MAPPING[search_inputs['departure_time_option']],
+        TIME_MAPPING[search_inputs['return_time_option']]
+    )
+
+    # Get the cheapest offer
+    cheapest_offer = get_cheapest_offer(filtered_offers)
+    if not cheapest_offer:
+        return None
+    flight_price = build_flight_price(cheapest_offer, departure_date_str, return_date_str, search_inputs['origin'], search_inputs['destination'])
+
+    # Rank all matching offers of the date in one batch, a dearer direct or much shorter one may be the best value
+    best_value_offer = rank_offers(filtered_offers, **(settings or {}).get('ranking', {}))[0]
+    flight_price['value_score'] = cheapest_offer['value_score']
+    flight_price['best_value'] = None
+    if best_value_offer is not cheapest_offer and best_value_offer['value_score'] < cheapest_offer['value_score']:
+        flight_price['best_value'] = build_flight_price(best_value_offer, departure_date_str, return_date_str, search_inputs['origin'], search_inputs['destination'])
+        flight_price['best_value']['value_score'] = best_value_offer['value_score']
+    return flight_price
+
+
+# Function to select the dates of the pre-pass, reusing the selection of an earlier run of the
+# same search and period within the checkpoint TTL. Returns None when the pre-pass is unavailable.
+def select_prepass_dates(search_inputs, search_key, departure_dates, start_date, end_date, access_token, api_url, settings):
+    prepass_key = f"{search_key}:prepass:{settings['prepass_top_k']}"
+    start_date_str = start_date.strftime('%Y-%m-%d')
+    end_date_str = end_date.strftime('%Y-%m-%d')
+
+    selection = get_checkpoints(prepass_key, settings['checkpoint_ttl_minutes']).get(start_date_str)
+    if selection and selection.get('end_date') == end_date_str:
+        return [datetime.strptime(d, '%Y-%m-%d').date() for d in selection['promising_dates']]
+
+    try:
+        flight_dates_data = get_flight_dates(
+            access_token, search_inputs['origin'], search_inputs['destination'],
+            start_date_str, end_date_str, int(search_inputs['number_of_nights']),
+            str(search_inputs['flight_type'] == "Direct").lower(), api_url
+        )
+        promising_dates = select_promising_dates(departure_dates, flight_dates_data, settings['prepass_top_k'])
+    except Exception as e:
+        print(f"Error in get_flight_dates, falling back to full sweep: {str(e)}", file=sys.stderr)
+        return None
+
+    if promising_dates:
+        insert_checkpoint(prepass_key, start_date_str, {
+            'end_date': end_date_str,
+            'promising_dates': [d.strftime('%Y-%m-%d') for d in promising_dates]
+        })
+    return promising_dates
+
+
+def _notify(callback, *args):
+    if callback is not None:
+        callback(*args)
+
+
+# Function to run the sweep of a search over its travel period and return the cheapest offer per date.
+# Progress is reported through the optional callbacks:
+#   on_progress(done, total), on_result(flight_prices) and on_notice(message)
+# Errors fetching offers are raised; completed dates are checkpointed, so a new run resumes from them.
+def run_sweep(search_inputs, search_inputs_id, access_token, api_url, settings,
+              on_progress=None, on_result=None, on_notice=None):
+    origin = search_inputs['origin']
+    destination = search_inputs['destination']
+    number_of_nights = int(search_inputs['number_of_nights'])
+    start_date = datetime.strptime(search_inputs['start_date'], '%Y-%m-%d').date()
+    end_date = datetime.strptime(search_inputs['end_date'], '%Y-%m-%d').date()
+
+    flight_prices = []  # Collect data for table and plotting
+
+    # Catch direct-flight searches on routes known to have no direct service
+    if search_inputs['flight_type'] == "Direct" and settings['route_check'] != 'off':
+        try:
+            has_direct_route = check_direct_route(origin, destination, settings, access_token, api_url)
+        except Exception as e:
+            print(f"Error checking route {origin}-{destination}: {e}", file=sys.stderr)
+            has_direct_route = None
+        if has_direct_route is False:
+            if settings['route_check'] == 'reject':
+                _notify(on_notice, f"No direct flights are known from {origin} to {destination}. Search skipped.")
+                return flight_prices
+            _notify(on_notice, f"No direct flights are known from {origin} to {destination}. This search may find no offers.")
+
+    # Dates to search: every matching weekday in the travel period
+    departure_dates = get_departure_dates(start_date, end_date, DAY_MAPPING[search_inputs['departure_day']])
+
+    search_key = get_sweep_key(search_inputs)
+
+    # Optional pre-pass: rough prices for the whole period from one calendar query, then only
+    # search the most promising dates in full. It runs over the whole period before completed
+    # dates are subtracted, so a re-submitted search selects the same dates as its first run.
+    if settings['prepass'] and len(departure_dates) > settings['prepass_top_k']:
+        promising_dates = select_prepass_dates(search_inputs, search_key, departure_dates, start_date, end_date,
+                                               access_token, api_url, settings)
+        if promising_dates:
+            departure_dates = promising_dates
+        else:
+            _notify(on_notice, "Cheapest-date pre-pass unavailable for this route, searching all dates.")
+
+    # Resume from the dates an earlier run of the same search already completed
+    checkpoints = get_checkpoints(search_key, settings['checkpoint_ttl_minutes'])
+    restored_dates = [d for d in departure_dates if d.strftime('%Y-%m-%d') in checkpoints]
+    for restored_date in restored_dates:
+        restored_flight_price = checkpoints[restored_date.strftime('%Y-%m-%d')]
+        if restored_flight_price:
+            flight_prices.append(restored_flight_price)
+    departure_dates = [d for d in departure_dates if d not in restored_dates]
+    if restored_dates:
+        _notify(on_notice, f"Resuming search: {len(restored_dates)} dates restored from an earlier run.")
+        _notify(on_result, flight_prices)
+
+    for progress_counter, current_date in enumerate(departure_dates):
+        # Update progress
+        _notify(on_progress, progress_counter, len(departure_dates))
+
+        departure_date_str = current_date.strftime('%Y-%m-%d')
+        return_date = current_date + timedelta(days=number_of_nights)
+        return_date_str = return_date.strftime('%Y-%m-%d')
+
+        # Fetch offers, waiting out the rate limit a few times before giving up
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                offers_data = fetch_offers(access_token, search_inputs, departure_date_str, return_date_str, api_url, settings)
+                break
+            except Exception as e:
+                if '429' in str(e) and attempt < RATE_LIMIT_RETRIES:
+                    _notify(on_notice, f"Rate limit reached. Waiting for {RATE_LIMIT_WAIT_SECONDS} seconds...")
+                    time.sleep(RATE_LIMIT_WAIT_SECONDS)
+                    continue
+                print(f"Error in get_offers: {str(e)}", file=sys.stderr)
+                logging.error(f"Error fetching offers: {str(e)}")
+                raise
+
+        try:
+            flight_price = process_offers(offers_data, search_inputs, search_inputs_id, departure_date_str, return_date_str, settings)
+
+            # Checkpoint the completed date, including dates without a matching offer
+            insert_checkpoint(search_key, departure_date_str, flight_price, search_inputs_id)
+
+        except Exception as e:
+            print(f"Outer exception: {str(e)}", file=sys.stderr)  # Debug line
+            _notify(on_notice, f"An error occurred while processing flight data: {str(e)}")
+            continue  # Skip to next date instead of breaking
+
+        # Report outside the error handling above, so callbacks can stop the sweep
+        if flight_price:
+            flight_prices.append(flight_price)
+            _notify(on_result, flight_prices)
+
+        # Pause to respect rate limit
+        if environment == "test":
+            time.sleep(0.5)
+        else:
+            time.sleep(0.05)
+
+    _notify(on_progress, len(departure_dates), len(departure_dates))
+
+    flight_prices.sort(key=lambda flight_price: flight_price['departure_date'])
+    print(f"Sweep {origin}-{destination} done, offer requests of this process: {get_coalescing_stats()}", file=sys.stderr)
+
+    # Record flight prices in database
+    if flight_prices and search_inputs_id:
+        insert_data(flight_prices, 'flight_prices', search_inputs_id)
+
+    return flight_prices
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import multiprocessing
+
+from search_offers import get_access_token
+from db_operations import create_tables, claim_job, update_job, finish_job
+from sweep import get_api_settings, load_sweep_settings, run_sweep
+
+# Background sweep workers: each process polls the sweep_jobs table in Postgres,
+# claims queued searches and runs their sweeps. Run any number of these, on any
+# host with access to the database and the API credentials:
+#   python app/sweep_worker.py --processes 4
+
+
+class JobReclaimed(Exception):
+    pass
+
+
+# Function to run the sweep of one claimed job and store its results. Every update is fenced
+# on the worker: once the job was reclaimed by another worker, the sweep stops at its next update.
+def run_job(job_id, worker, search_inputs_id, search_inputs, settings):
+    api_url, api_key, api_secret = get_api_settings()
+
+    def check_held(updated):
+        if updated is False:
+            raise JobReclaimed(f"Job {job_id} was reclaimed by another worker")
+
+    def on_progress(done, total):
+        check_held(update_job(job_id, worker, progress=done, total=total))
+
+    def on_result(flight_prices):
+        check_held(update_job(job_id, worker, result=flight_prices))
+
+    def on_notice(message):
+        check_held(update_job(job_id, worker, notice=message))
+
+    try:
+        access_token = get_access_token(api_key, api_secret, api_url)
+        flight_prices = run_sweep(
+            search_inputs, search_inputs_id, access_token, api_url, settings,
+            on_progress=on_progress, on_result=on_result, on_notice=on_notice
+        )
+        if finish_job(job_id, worker, result=flight_prices) is False:
+            print(f"Job {job_id} was reclaimed by another worker, results dropped", file=sys.stderr)
+        else:
+            print(f"Job {job_id} done with {len(flight_prices)} results", file=sys.stderr)
+    except JobReclaimed as e:
+        print(f"{e}, stopping its sweep", file=sys.stderr)
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}", file=sys.stderr)
+        finish_job(job_id, worker, error=str(e))
+
+
+# Function to claim and run jobs until stopped
+def worker_loop(poll_seconds, stale_after_seconds):
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    settings = load_sweep_settings()
+    print(f"Sweep worker {worker} started", file=sys.stderr)
+    while True:
+        job = claim_job(worker, stale_after_seconds)
+        if job is None:
+            time.sleep(poll_seconds)
+            continue
+        job_id, search_inputs_id, search_inputs = job
+        print(f"Worker {worker} claimed job {job_id}", file=sys.stderr)
+        run_job(job_id, worker, search_inputs_id, search_inputs, settings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background sweep workers")
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--poll-seconds', type=float, default=2.0, help="Wait between polls of an empty queue")
+    parser.add_argument('--stale-after-seconds', type=int, default=300, help="Reclaim running jobs without a heartbeat for this long")
+    args = parser.parse_args()
+
+    # Ensure tables exist
+    create_tables()
+
+    processes = [
+        multiprocessing.Process(target=worker_loop, args=(args.poll_seconds, args.stale_after_seconds))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
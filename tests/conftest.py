@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+import psycopg2
+
+# The app modules import each other from app/, as when the app runs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+# Tables of the test run get their own suffix, apart from the test and production tables
+os.environ['ENVIRONMENT'] = 'pytest'
+
+
+# Local Postgres reachable with the DB_* variables of .env, tables created; skips the test otherwise
+@pytest.fixture
+def postgres():
+    import db_operations
+    try:
+        db_operations.get_db_connection().close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Local Postgres not available: {e}")
+    db_operations.create_tables()
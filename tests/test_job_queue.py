@@ -0,0 +1,63 @@
+import time
+import pytest
+
+import db_operations
+from db_operations import insert_job, claim_job, update_job, finish_job, get_job
+
+# Needs a local Postgres, see the postgres fixture
+
+
+def _delete_jobs():
+    conn = db_operations.get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM sweep_jobs_{db_operations.environment}")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+@pytest.fixture
+def job_queue(postgres):
+    _delete_jobs()
+    yield
+    _delete_jobs()
+
+
+def test_claim_update_and_finish(job_queue):
+    job_id = insert_job({'origin': 'ZRH', 'destination': 'OPO'})
+
+    job = claim_job('worker-1')
+    assert job[0] == job_id
+    assert job[2]['origin'] == 'ZRH'
+    # A running job with a fresh heartbeat is not claimed twice
+    assert claim_job('worker-2') is None
+
+    assert update_job(job_id, 'worker-1', progress=1, total=2) is True
+    assert finish_job(job_id, 'worker-1', result=[]) is True
+
+    job = get_job(job_id)
+    assert job['status'] == 'done'
+    assert job['progress'] == 1 and job['total'] == 2
+    assert job['worker'] == 'worker-1'
+
+
+def test_reclaimed_job_is_fenced_from_its_first_worker(job_queue):
+    job_id = insert_job({'origin': 'ZRH', 'destination': 'OPO'})
+    assert claim_job('worker-1')[0] == job_id
+
+    # worker-1 stops sending heartbeats and worker-2 reclaims the job
+    time.sleep(1.5)
+    assert claim_job('worker-2', stale_after_seconds=1)[0] == job_id
+
+    # worker-1 wakes up: its updates and results no longer reach the job
+    assert update_job(job_id, 'worker-1', progress=3, total=4) is False
+    assert finish_job(job_id, 'worker-1', error='late failure') is False
+
+    assert update_job(job_id, 'worker-2', progress=1, total=4) is True
+    assert finish_job(job_id, 'worker-2', result=[]) is True
+
+    job = get_job(job_id)
+    assert job['status'] == 'done'
+    assert job['worker'] == 'worker-2'
+    assert job['progress'] == 1
+    assert job['error'] is None
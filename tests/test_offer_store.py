@@ -0,0 +1,136 @@
+import json
+import pytest
+
+import db_operations
+from db_operations import DateTimeEncoder, insert_data
+from search_offers import parse_offers
+from offer_store import split_offers, assemble_offers, migrate_parsed_offers, get_parsed_offers, get_storage_report
+
+
+def _segment(origin, destination, departure_at, arrival_at, number, duration):
+    return {
+        'departure': {'iataCode': origin, 'at': departure_at},
+        'arrival': {'iataCode': destination, 'at': arrival_at},
+        'carrierCode': 'LX', 'number': number, 'duration': duration
+    }
+
+
+# Raw API response: a direct offer and a cheaper one-stop offer, each listed twice
+OFFERS_DATA = {'data': [
+    {
+        'price': {'total': '130.00', 'currency': 'EUR'},
+        'itineraries': [
+            {'duration': 'PT2H15M', 'segments': [_segment('ZRH', 'OPO', '2026-11-06T08:00:00', '2026-11-06T09:15:00', '2086', 'PT2H15M')]},
+            {'duration': 'PT2H10M', 'segments': [_segment('OPO', 'ZRH', '2026-11-08T10:00:00', '2026-11-08T13:10:00', '2087', 'PT2H10M')]}
+        ]
+    },
+    {
+        'price': {'total': '95.50', 'currency': 'EUR'},
+        'itineraries': [
+            {'duration': 'PT6H', 'segments': [
+                _segment('ZRH', 'LIS', '2026-11-06T07:00:00', '2026-11-06T08:45:00', '2080', 'PT2H45M'),
+                _segment('LIS', 'OPO', '2026-11-06T11:00:00', '2026-11-06T12:00:00', '1944', 'PT1H')
+            ]},
+            {'duration': 'PT5H30M', 'segments': [
+                _segment('OPO', 'LIS', '2026-11-08T09:00:00', '2026-11-08T10:00:00', '1945', 'PT1H'),
+                _segment('LIS', 'ZRH', '2026-11-08T11:30:00', '2026-11-08T15:30:00', '2081', 'PT3H')
+            ]}
+        ]
+    }
+] * 2}
+
+
+def _as_stored(data):
+    # JSON as written to and read back from Postgres
+    return json.loads(json.dumps(data, cls=DateTimeEncoder))
+
+
+def _round_trip(parsed_offers):
+    segments, itineraries, observations = split_offers(parsed_offers)
+    stored_segments = {segment_hash: _as_stored(segment) for segment_hash, segment in segments.items()}
+    stored_itineraries = {itinerary_hash: (segment_hashes, _as_stored(summary))
+                          for itinerary_hash, (segment_hashes, summary) in itineraries.items()}
+    stored_observations = [(float(price), currency, hashes) for price, currency, hashes in observations]
+    return assemble_offers(stored_observations, stored_itineraries, stored_segments)
+
+
+def _legacy_offers():
+    # Parsed offers as recorded before travel times and stops were precomputed
+    legacy_offers = _as_stored(parse_offers(OFFERS_DATA))
+    for offer in legacy_offers:
+        for key in ('total_duration_minutes', 'total_stops', 'layover_minutes'):
+            del offer[key]
+        for itinerary in offer['itineraries']:
+            for key in ('duration_minutes', 'stops', 'layover_minutes'):
+                del itinerary[key]
+            for segment in itinerary['segments']:
+                del segment['duration_minutes']
+    for offer in legacy_offers:
+        for itinerary in offer['itineraries']:
+            db_operations.decode_itinerary(itinerary)
+    return legacy_offers
+
+
+def test_split_stores_each_itinerary_and_segment_once():
+    segments, itineraries, observations = split_offers(parse_offers(OFFERS_DATA))
+    assert len(segments) == 6
+    assert len(itineraries) == 4
+    assert len(observations) == 4
+    assert observations[0][2] == observations[2][2]
+
+
+def test_round_trip_of_current_format():
+    parsed_offers = parse_offers(OFFERS_DATA)
+    assert _round_trip(parsed_offers) == parsed_offers
+
+
+def test_round_trip_of_legacy_format():
+    current_offers = parse_offers(OFFERS_DATA)
+    assembled_offers = _round_trip(_legacy_offers())
+
+    for assembled, current in zip(assembled_offers, current_offers):
+        assert assembled['price'] == current['price']
+        for key in ('total_duration_minutes', 'total_stops', 'layover_minutes'):
+            assert assembled[key] == current[key]
+        for assembled_itinerary, current_itinerary in zip(assembled['itineraries'], current['itineraries']):
+            for key in ('duration_minutes', 'stops', 'layover_minutes'):
+                assert assembled_itinerary[key] == current_itinerary[key]
+            assert assembled_itinerary['segments'][0]['departure']['at'] == current_itinerary['segments'][0]['departure']['at']
+
+
+def _delete_offers():
+    conn = db_operations.get_db_connection()
+    cur = conn.cursor()
+    environment = db_operations.environment
+    for table in ('offer_observations', 'offer_snapshots', 'offer_itineraries', 'offer_segments', 'parsed_offers'):
+        cur.execute(f"DELETE FROM {table}_{environment}")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+@pytest.fixture
+def offer_tables(postgres):
+    _delete_offers()
+    yield
+    _delete_offers()
+
+
+def test_migration_runs_once_and_rebuilds_each_date_once(offer_tables):
+    search_inputs_id = insert_data({'origin': 'ZRH', 'destination': 'OPO'}, 'search_inputs')
+    insert_data(_legacy_offers(), 'parsed_offers', search_inputs_id)
+    insert_data(parse_offers(OFFERS_DATA), 'parsed_offers', search_inputs_id)
+
+    assert migrate_parsed_offers() == 2
+    assert migrate_parsed_offers() == 0
+
+    recorded = get_parsed_offers(search_inputs_id)
+    assert len(recorded) == 2
+    for parsed_offers in recorded:
+        assert [offer['total_stops'] for offer in parsed_offers] == [0, 2, 0, 2]
+
+    report = get_storage_report()
+    assert report['tables']['offer_snapshots']['rows'] == 2
+    assert report['dedup_writes'] == 2
+    assert report['dedup_offers_per_second'] > 0
+    assert report['space_saved_percent'] is not None